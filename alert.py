@@ -0,0 +1,149 @@
+import json
+import metrics
+import sys
+import zlib
+
+INF = float('inf')
+
+# bits of Alert.held, set while the deadband alone keeps a level over its set-point
+HELD_WARN = 1
+HELD_CRITICAL = 2
+
+
+class Alert(object):
+  """ The alert object, a fixed-field record built from the creation dict.
+      __slots__ instead of a per-object __dict__, names and messages interned,
+      and the nested warn/critical dicts flattened into plain fields.
+      Keys the engine does not use are dropped.
+      Each level clears at its own `clear` value, or `deadbandPct` under the set-point,
+      so a value hovering at the set-point does not flap. The default is no deadband.
+  """
+  __slots__ = (
+    'name', 'query', 'intervalSecs', 'repeatIntervalSecs', 'sustainSecs',
+    'warn_value', 'warn_message', 'critical_value', 'critical_message',
+    'warn_clear', 'critical_clear',
+    'state', 'triggered_sec', 'next_due', 'slot', 'shard', 'digest',
+    'warn_since', 'critical_since', 'held', 'behind',
+  )
+
+  def __init__(self, data, deadband=0):
+    # new k,v
+    self.state = 'PASS'
+    self.triggered_sec = 0
+    self.next_due = 0
+    # monotonic start of the current unbroken run over each set-point, inf while under
+    self.warn_since = INF
+    self.critical_since = INF
+    self.held = 0
+    # index into the AlertStore arrays, -1 until stored and again once removed
+    self.slot = -1
+    # poll worker group holding the alert
+    self.shard = 0
+    # missed slots the last poll found, see scheduler.newly_missed
+    self.behind = 0
+    self.load(data, deadband)
+
+  def load(self, data, deadband=0):
+    """ (Re)load the definition from the server dict, lifecycle state is untouched.
+        deadband is the percentage used when the alert sets neither `clear` nor `deadbandPct`.
+    """
+    # content hash, the catalogue reconciler only touches alerts whose definition changed
+    self.digest = digest(data)
+    # passed in k,v
+    self.name = sys.intern(data['name'])
+    self.query = sys.intern(data['query'])
+    self.intervalSecs = data['intervalSecs']
+    self.repeatIntervalSecs = data['repeatIntervalSecs']
+    self.sustainSecs = data.get('sustainSecs', 0)
+    self.warn_value = data['warn']['value']
+    self.warn_message = sys.intern(data['warn']['message'])
+    self.critical_value = data['critical']['value']
+    self.critical_message = sys.intern(data['critical']['message'])
+    deadband = data.get('deadbandPct', deadband)
+    self.warn_clear = clear_value(data['warn'], deadband)
+    self.critical_clear = clear_value(data['critical'], deadband)
+
+  def __repr__(self):
+    return f"Alert({self.name!r}, {self.query!r}, {self.state!r})"
+
+
+def clear_value(level, deadband):
+  """ Value a level clears at: its own `clear`, else deadband percent under the set-point.
+      Never above the set-point, that would clear a level the value is still over.
+  """
+  value = level['value']
+  return min(level.get('clear', value - abs(value) * deadband / 100), value)
+
+
+def sustained(item, value, now):
+  """ val2state honouring sustainSecs and the deadband. A level only fires once the value has
+      stayed over its set-point for sustainSecs, O(1) with one running-since timestamp per level.
+      Once fired, it stays over until the value drops to its clear value. A run still
+      waiting out sustainSecs has not fired, dropping under the set-point ends it.
+  """
+  over_warn = value > item.warn_value
+  over_critical = value > item.critical_value
+  fired_critical = item.state == item.critical_message
+  fired_warn = fired_critical or item.state == item.warn_message
+  held_warn = not over_warn and fired_warn and item.warn_since < INF and value > item.warn_clear
+  held_critical = not over_critical and fired_critical and item.critical_since < INF and value > item.critical_clear
+  # a held level going back over is a resolve and a re-notify that never happened
+  if over_warn and item.held & HELD_WARN:
+    metrics.deadband_suppressed.inc('warning')
+  if over_critical and item.held & HELD_CRITICAL:
+    metrics.deadband_suppressed.inc('critical')
+  item.held = HELD_WARN * held_warn | HELD_CRITICAL * held_critical
+  item.warn_since = min(item.warn_since, now) if over_warn or held_warn else INF
+  item.critical_since = min(item.critical_since, now) if over_critical or held_critical else INF
+  if now - item.critical_since >= item.sustainSecs:
+    return item.critical_message
+  if now - item.warn_since >= item.sustainSecs:
+    return item.warn_message
+  return 'PASS'
+
+
+# events emitted by a state transition
+NOTIFY = 'notify'
+REPEAT = 'repeat'
+RESOLVE = 'resolve'
+
+
+def transition(item, new_state, now):
+  """ Apply a freshly evaluated state to the alert, returns the event it emits or None.
+      PASS->warning, warning->critical and the like are NOTIFY, anything->PASS is RESOLVE,
+      still firing once repeatIntervalSecs has passed is REPEAT.
+      triggered_sec starts the cool-down on NOTIFY and REPEAT, and clears on RESOLVE.
+  """
+  if new_state == item.state:
+    # First time, or re-trigger
+    if new_state != 'PASS' and item.triggered_sec + item.repeatIntervalSecs < now:
+      item.triggered_sec = now
+      return REPEAT
+    return None
+
+  item.state = new_state
+  if new_state == 'PASS':
+    item.triggered_sec = 0
+    return RESOLVE
+  item.triggered_sec = now
+  return NOTIFY
+
+
+def digest(data):
+  """ Stable content hash of an alert definition dict """
+  return zlib.crc32(json.dumps(data, sort_keys=True).encode())
+
+
+def val2state(item, value):
+  """ Compare the numeric value with the alert set-points """
+  state = None
+  # PASS (less than or equal to warn thresh)
+  if value <= item.warn_value:
+    state = 'PASS'
+  # WARNING (greater than warn thresh, less than or equal to critical)
+  if value > item.warn_value:
+    state = item.warn_message
+  # CRITICAL (greater than critital)
+  if value > item.critical_value:
+    state = item.critical_message
+  return state
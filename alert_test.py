@@ -0,0 +1,36 @@
+#!env python3
+
+from alert import Alert, NOTIFY, REPEAT, RESOLVE, transition
+import unittest
+
+
+def make():
+  return Alert({
+    'name': 'alert-1',
+    'query': 'test-query-1',
+    'intervalSecs': 15,
+    'repeatIntervalSecs': 100,
+    'warn': {'value': 100, 'message': 'warning'},
+    'critical': {'value': 200, 'message': 'critical'},
+  })
+
+
+class TestTransition(unittest.TestCase):
+
+  def test_lifecycle(self):
+    item = make()
+    self.assertIsNone(transition(item, 'PASS', 1000))
+    self.assertEqual(transition(item, 'warning', 1000), NOTIFY)
+    self.assertEqual(item.triggered_sec, 1000)
+    # escalation notifies at once, no waiting out the warning cool-down
+    self.assertEqual(transition(item, 'critical', 1010), NOTIFY)
+    self.assertEqual(item.triggered_sec, 1010)
+    # still critical, nothing until repeatIntervalSecs has passed
+    self.assertIsNone(transition(item, 'critical', 1110))
+    self.assertEqual(transition(item, 'critical', 1111), REPEAT)
+    self.assertEqual(transition(item, 'PASS', 1120), RESOLVE)
+    self.assertEqual((item.state, item.triggered_sec), ('PASS', 0))
+
+
+if __name__ == '__main__':
+  unittest.main()
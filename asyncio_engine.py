@@ -0,0 +1,188 @@
+""" asyncio engine. Same lifecycle as the threaded poll worker and dispatcher in main.py,
+    but every alert cycle is a coroutine sharing one pooled AsyncClient.
+    Concurrency is bounded by the client in-flight limit instead of thread count.
+"""
+
+from alert import RESOLVE, sustained, transition
+from client import AsyncClient
+from ratelimit import CircuitOpen, backoff
+from math import floor
+from scheduler import COALESCE, SKIP, Scheduler, first_deadline, missed_slots, newly_missed, next_deadline
+from time import time, monotonic
+import asyncio
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+async def poll(item, client, INTERVAL, RETRY, journal=None):
+  """ coroutine 1/3 : query, evaluate, and send whatever event the state transition emits """
+  val = None
+  for attempt in range(RETRY):
+    try:
+      val = await client.query(item.query)
+      break
+    # backend is down, do not pile on, try again next slot
+    except CircuitOpen as err:
+      logger.debug("poll skipped query for %s: %s", item.name, err)
+      break
+    except Exception as err:
+      logger.warning("poll failed query attempt #%d for %s: %s", attempt, item.name, err)
+      if attempt + 1 < RETRY:
+        metrics.retries.inc('query')
+      await asyncio.sleep(backoff(attempt, cap=INTERVAL))
+
+  # all attempts exhausted, try again next slot
+  if val is None:
+    return
+  # reconcile removed the alert while its query was in flight
+  if item.slot < 0:
+    return
+
+  # state transition, only an event costs a call
+  previous_sec = item.triggered_sec
+  event = transition(item, sustained(item, val, monotonic()), floor(time()))
+  if event is not None and journal is not None:
+    journal.record(item)
+  if event == RESOLVE:
+    await resolve(item, client, INTERVAL, RETRY)
+  elif event is not None:
+    await notify(item, previous_sec, client, INTERVAL, RETRY, journal)
+
+
+async def notify(item, previous_sec, client, INTERVAL, RETRY, journal=None):
+  """ coroutine 2/3 : send notifications. transition() already started the cool-down """
+  for attempt in range(RETRY):
+    try:
+      logger.info("notify triggered %s %s", item.name, item.state)
+      await client.notify(item.name, item.state)
+      return
+    except CircuitOpen as err:
+      logger.warning("notify deferred %s: %s", item.name, err)
+      break
+    except Exception as err:
+      logger.warning("notify failed attempt #%d for %s: %s", attempt, item.name, err)
+      if attempt + 1 < RETRY:
+        metrics.retries.inc('notify')
+      await asyncio.sleep(backoff(attempt, cap=INTERVAL))
+  # not sent, so the cool-down never started. Next poll tries again
+  item.triggered_sec = previous_sec
+  if journal is not None:
+    journal.record(item)
+
+
+async def resolve(item, client, INTERVAL, RETRY):
+  """ coroutine 3/3 : send resolution signals """
+  for attempt in range(RETRY):
+    try:
+      logger.info("resolve resolving attempt #%d for %s", attempt, item.name)
+      await client.resolve(item.name)
+      return
+    except CircuitOpen as err:
+      # backend is down, wait a tick for the breaker rather than lose the resolve
+      logger.warning("resolve deferred %s: %s", item.name, err)
+      await asyncio.sleep(INTERVAL)
+    except Exception as err:
+      logger.warning("resolve failed attempt #%d for %s: %s", attempt, item.name, err)
+      if attempt + 1 < RETRY:
+        metrics.retries.inc('resolve')
+      await asyncio.sleep(backoff(attempt, cap=INTERVAL))
+
+
+async def cycle(item, pollQ, client, INTERVAL, RETRY, journal=None):
+  """ One poll of one alert, then back on the scheduler at its next deadline """
+  try:
+    await poll(item, client, INTERVAL, RETRY, journal)
+  finally:
+    # unless it was dropped from the catalogue meanwhile
+    if item.slot >= 0:
+      pollQ.put(item, item.next_due)
+
+
+async def reconcile(store, pollQ, client, INTERVAL, RETRY, REFRESH, owned=None):
+  """ Re-fetch the catalogue every REFRESH seconds and apply only what changed.
+      owned filters the catalogue to this process's shard, like main.owned
+  """
+  while True:
+    await asyncio.sleep(REFRESH)
+    try:
+      catalogue = await client.query_alerts()
+    except Exception as err:
+      logger.warning("reconcile failed to refresh alerts: %s", err)
+      continue
+    # an empty answer is a backend hiccup, not every alert deleted
+    if not catalogue:
+      continue
+
+    added, removed, updated = store.reconcile(owned(catalogue) if owned is not None else catalogue)
+    for item in added:
+      pollQ.put(item, first_deadline(item.query, item.intervalSecs))
+    for item in removed:
+      # resolve anything still firing so no page dangles
+      if item.state != 'PASS':
+        await resolve(item, client, INTERVAL, RETRY)
+    if added or removed or updated:
+      logger.info("reconcile added %d, removed %d, updated %d alerts, %d total", len(added), len(removed), len(updated), len(store))
+
+
+async def checkpoint(store, journal, PERIOD):
+  """ Compact the journal every PERIOD seconds. Rare and short, so a blocking write is fine """
+  while True:
+    await asyncio.sleep(PERIOD)
+    try:
+      journal.checkpoint(store)
+    except Exception as err:
+      logger.warning("checkpoint failed to write %s: %s", journal.path, err)
+
+
+async def engine(store, INTERVAL, RETRY, INFLIGHT, REFRESH=0, address='', limits=None, journal=None, SNAPSHOT=60, pacer=None,
+                 timeout=(3.05, 10), CATCH_UP=COALESCE, owned=None):
+  """ Launch a cycle for every due alert, then sleep until the next deadline """
+  pollQ = Scheduler()
+  # each alert at its own phase of its interval, not all at once
+  for item in store:
+    pollQ.put(item, first_deadline(item.query, item.intervalSecs))
+
+  # keep references, the event loop only holds weak ones
+  tasks = set()
+  async with AsyncClient(address, INFLIGHT, limits, pacer, timeout) as client:
+    if REFRESH > 0:
+      refresher = asyncio.create_task(reconcile(store, pollQ, client, INTERVAL, RETRY, REFRESH, owned))
+    if journal is not None:
+      checkpointer = asyncio.create_task(checkpoint(store, journal, SNAPSHOT))
+    metrics.REGISTRY.register(metrics.Gauge(
+      'alert_exec_queue_depth', 'Alerts scheduled per poll shard', lambda: {('asyncio',): pollQ.qsize()}, ('shard',)))
+    while True:
+      start = monotonic()
+      for item in pollQ.pop_due(start):
+        # dropped from the catalogue
+        if item.slot < 0:
+          continue
+        lag = start - item.next_due
+        metrics.schedule_lag.observe(lag, 'asyncio')
+        missed = missed_slots(lag, item.intervalSecs)
+        counted = newly_missed(item, missed, CATCH_UP)
+        if counted:
+          metrics.missed_slots.inc('asyncio', value=counted)
+        if missed and CATCH_UP == SKIP:
+          metrics.skipped_polls.inc('asyncio')
+          pollQ.put(item, next_deadline(item.next_due, item.intervalSecs, start, SKIP))
+          continue
+        item.next_due = next_deadline(item.next_due, item.intervalSecs, start, CATCH_UP)
+        task = asyncio.create_task(cycle(item, pollQ, client, INTERVAL, RETRY, journal))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+      logger.debug("asyncio engine %d alerts in flight, %d scheduled", len(tasks), pollQ.qsize())
+
+      # wake for the earliest deadline, but at least every INTERVAL since cycles reschedule behind us
+      earliest = pollQ.peek()
+      wait = INTERVAL if earliest is None else min(INTERVAL, max(0, earliest - monotonic()))
+      await asyncio.sleep(wait)
+
+
+def run(store, INTERVAL, RETRY, INFLIGHT, REFRESH=0, address='', limits=None, journal=None, SNAPSHOT=60, pacer=None,
+        timeout=(3.05, 10), CATCH_UP=COALESCE, owned=None):
+  """ Blocking entrypoint called from main.main """
+  asyncio.run(engine(store, INTERVAL, RETRY, INFLIGHT, REFRESH, address, limits, journal, SNAPSHOT, pacer, timeout, CATCH_UP,
+                     owned))
@@ -0,0 +1,109 @@
+#!env python3
+
+from scheduler import Scheduler
+from store import AlertStore
+from threading import Thread
+import asyncio
+import asyncio_engine
+import fake_server
+import unittest
+
+
+class Catalogue(object):
+  """ Just enough AsyncClient for reconcile """
+  def __init__(self, alerts):
+    self.alerts = alerts
+
+  async def query_alerts(self):
+    return self.alerts
+
+
+class Removing(object):
+  """ Just enough AsyncClient for poll, reconcile drops the alert while its query is in flight """
+  def __init__(self, store, name):
+    self.store = store
+    self.name = name
+    self.calls = []
+
+  async def query(self, query):
+    self.store.remove(self.name)
+    return 250
+
+  async def notify(self, name, state):
+    self.calls.append(('notify', name))
+
+  async def resolve(self, name):
+    self.calls.append(('resolve', name))
+
+
+class TestPoll(unittest.TestCase):
+
+  def test_removed_while_polling(self):
+    store = AlertStore()
+    alert = fake_server.make_alerts(1, 1)[0]
+    item = store.add(alert)
+    client = Removing(store, item.name)
+    asyncio.run(asyncio_engine.poll(item, client, 1, 1))
+    # the value came back for a dead alert, nothing is evaluated or sent
+    self.assertEqual(item.slot, -1)
+    self.assertEqual(item.state, 'PASS')
+    self.assertEqual(client.calls, [])
+
+
+class TestReconcile(unittest.TestCase):
+
+  def test_only_owned(self):
+    alerts = fake_server.make_alerts(10, 5)
+    store = AlertStore()
+    pollQ = Scheduler()
+
+    def owned(catalogue):
+      return [a for a in catalogue if int(a['name'].split('-')[1]) % 2 == 0]
+
+    async def refresh_once():
+      task = asyncio.create_task(asyncio_engine.reconcile(store, pollQ, Catalogue(alerts), 1, 1, 0.01, owned))
+      await asyncio.sleep(0.1)
+      task.cancel()
+    asyncio.run(refresh_once())
+    # the other shard's alerts are never added
+    self.assertEqual(sorted(item.name for item in store), [f"alert-{i}" for i in (0, 2, 4, 6, 8)])
+    self.assertEqual(pollQ.qsize(), 5)
+
+
+class TestEngine(unittest.TestCase):
+
+  def test_poll_notify_resolve(self):
+    alerts = fake_server.make_alerts(4, 2)
+    for alert in alerts:
+      alert['intervalSecs'] = 0.1
+    # every query draws a fresh value in 0..300 against warn 100 and critical 200, so alerts flap
+    server = fake_server.FakeServer(('127.0.0.1', 0), alerts)
+    Thread(target=server.serve_forever, daemon=True).start()
+    store = AlertStore()
+    for alert in alerts:
+      store.add(alert)
+
+    async def run_for(seconds):
+      try:
+        # the engine wakes at least every INTERVAL for cycles rescheduled while it slept
+        engine = asyncio_engine.engine(store, 0.05, 1, 10, address=f"http://127.0.0.1:{server.server_address[1]}")
+        await asyncio.wait_for(engine, seconds)
+      except asyncio.TimeoutError:
+        pass
+    try:
+      asyncio.run(run_for(1.5))
+    finally:
+      server.shutdown()
+      server.server_close()
+    counters = server.counters
+    self.assertGreater(counters.get('query', 0), 20)
+    self.assertGreater(counters.get('notify', 0), 0)
+    self.assertGreater(counters.get('resolve', 0), 0)
+    # every call went out for a real transition, notifies and resolves alternate per alert
+    for name in (a['name'] for a in alerts):
+      kinds = [kind for kind, event in server.events if event['alertName'] == name]
+      self.assertTrue(all(kind != 'resolve' or previous == 'notify' for previous, kind in zip(kinds, kinds[1:])))
+
+
+if __name__ == '__main__':
+  unittest.main()
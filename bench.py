@@ -0,0 +1,456 @@
+#!env python3
+""" Benchmarks for the alert-exec hot paths. Each subcommand prints one result line per size """
+
+from time import monotonic, perf_counter, sleep
+import argparse
+import json
+import random
+
+
+def make_data(count, targets=None):
+  """ Alert dicts shaped like the backend's, with random set-points """
+  data = []
+  for i in range(count):
+    warn = random.uniform(50, 150)
+    data.append({
+      'name': f"alert-{i}",
+      'query': f"test-query-{i % (targets or count)}",
+      'intervalSecs': 15,
+      'repeatIntervalSecs': 100,
+      'sustainSecs': 0,
+      'warn': {'value': warn, 'message': 'warning'},
+      'critical': {'value': warn + 100, 'message': 'critical'},
+    })
+  return data
+
+
+def make_items(count):
+  """ Alert objects shaped like the backend's, with random set-points """
+  from alert import Alert
+  return [Alert(d) for d in make_data(count)]
+
+
+class DictAlert(object):
+  """ The original setattr built Alert, kept here as the memory baseline """
+  def __init__(self, data):
+    self.state = 'PASS'
+    self.triggered_sec = 0
+    for key in data:
+      setattr(self, key, data[key])
+
+
+def bench_store(sizes, targets):
+  """ Heap held by the alerts once built, original setattr objects against AlertStore """
+  from store import AlertStore
+  import gc
+  import tracemalloc
+  for count in sizes:
+    results = {}
+    for label in ('setattr', 'store'):
+      doc = json.dumps(make_data(count, targets))
+      gc.collect()
+      tracemalloc.start()
+      # decode inside the trace, like query_alerts does, so strings and nested dicts count
+      data = json.loads(doc)
+      if label == 'setattr':
+        held = [DictAlert(d) for d in data]
+      else:
+        held = AlertStore(count)
+        for d in data:
+          held.add(d)
+      # the decoded catalogue is released once alerts are built
+      del data
+      gc.collect()
+      results[label] = tracemalloc.get_traced_memory()[0]
+      tracemalloc.stop()
+      del held
+    print(f"store {count:>8} alerts  setattr {results['setattr'] / count:7.0f} B/alert"
+          f"  store {results['store'] / count:7.0f} B/alert  ({results['setattr'] / results['store']:4.1f}x smaller)")
+
+
+def bench_val2state(sizes, rounds):
+  """ Per-alert cost of scalar alert.sustained, what a small poll pass runs, against the
+      vectorized ThresholdTable forced on for every size
+  """
+  from alert import sustained, val2state
+  import thresholds
+  from thresholds import ThresholdTable, load_numpy
+  np = load_numpy()
+  print(f"thresholds backend: {'numpy' if np is not None else 'python lists'}, scalar below {thresholds.SCALAR_BELOW} alerts")
+  scalar_below, thresholds.SCALAR_BELOW = thresholds.SCALAR_BELOW, 0
+  for count in sizes:
+    items = make_items(count)
+    values = [random.uniform(0, 300) for _ in items]
+    table = ThresholdTable(count)
+    for item in items:
+      table.add(item)
+
+    start = perf_counter()
+    for _ in range(rounds):
+      [sustained(item, value, 0) for item, value in zip(items, values)]
+    scalar_ns = (perf_counter() - start) / rounds / count * 1e9
+
+    # codes and transition mask only, what a batched pipeline consumes
+    slots = list(range(count))
+    if np is not None:
+      slots, values_arr = np.asarray(slots), np.asarray(values)
+    else:
+      values_arr = values
+    start = perf_counter()
+    for _ in range(rounds):
+      table.evaluate(slots, values_arr, 0)
+    codes_ns = (perf_counter() - start) / rounds / count * 1e9
+
+    # codes mapped back to state strings, what poll consumes
+    start = perf_counter()
+    for _ in range(rounds):
+      vector = table.states(items, values, 0)
+    states_ns = (perf_counter() - start) / rounds / count * 1e9
+
+    assert [val2state(item, value) for item, value in zip(items, values)] == vector
+    print(f"val2state {count:>8} alerts  scalar {scalar_ns:7.1f} ns/alert"
+          f"  vector codes {codes_ns:7.1f} ns/alert ({scalar_ns / codes_ns:5.1f}x)"
+          f"  vector states {states_ns:7.1f} ns/alert ({scalar_ns / states_ns:5.1f}x)")
+  thresholds.SCALAR_BELOW = scalar_below
+
+
+def load_catalogue(port, mode, trace, conn):
+  """ Catalogue process for bench catalogue: fetch /alerts whole or streamed into an AlertStore.
+      tracemalloc slows allocation down several times, so heap and timings come from separate runs.
+  """
+  from client import Client
+  from store import AlertStore
+  import resource
+  import tracemalloc
+  client = Client(f"http://127.0.0.1:{port}")
+  store = AlertStore()
+  if trace:
+    tracemalloc.start()
+  start = perf_counter()
+  first = None
+  if mode == 'whole':
+    catalogue = client.query_alerts()
+    while catalogue:
+      store.add(catalogue.pop())
+      if first is None:
+        first = perf_counter() - start
+  else:
+    for data in client.iter_alerts():
+      store.add(data)
+      if first is None:
+        first = perf_counter() - start
+  elapsed = perf_counter() - start
+  held, peak = tracemalloc.get_traced_memory()
+  conn.send({'first': first, 'elapsed': elapsed, 'held': held, 'peak': peak,
+             'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, 'alerts': len(store)})
+  conn.close()
+
+
+def bench_catalogue(sizes, port):
+  """ Startup cost of /alerts: time to the first alert, total time, peak heap and RSS """
+  import multiprocessing
+  from urllib.request import urlopen
+  for count in sizes:
+    args = argparse.Namespace(fanout=10, latency=0, distribution='fixed', error_rate=0, change_rate=1, slow=0)
+    server = multiprocessing.Process(target=run_server, args=[port, count, args], daemon=True)
+    server.start()
+    fetch_json(f"http://127.0.0.1:{port}/stats")
+    with urlopen(f"http://127.0.0.1:{port}/alerts") as response:
+      size = len(response.read())
+    results = {}
+    for mode in ('whole', 'stream'):
+      for trace in (False, True):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        loader = multiprocessing.Process(target=load_catalogue, args=[port, mode, trace, sender])
+        loader.start()
+        result = receiver.recv()
+        loader.join()
+        if trace:
+          results[mode]['peak'] = result['peak']
+        else:
+          results[mode] = result
+    server.terminate()
+    server.join()
+    line = f"catalogue {count:>8} alerts {size / 2**20:6.1f} MB"
+    for mode, r in results.items():
+      line += (f"  {mode} first {r['first'] * 1000:7.1f}ms total {r['elapsed']:5.2f}s"
+               f" peak {r['peak'] / 2**20:6.1f} MB rss {r['rss'] / 2**20:6.1f} MB")
+    print(line)
+
+
+def bench_startup(sizes, rounds, late):
+  """ CLI import time, and time from launching main.py to its first backend query, whole vs streamed.
+      With late > 0 the metrics source comes up that many seconds after the engine, as in a rollout,
+      and the time is counted from the source answering.
+  """
+  import multiprocessing
+  import os
+  import statistics
+  import subprocess
+  import sys
+  here = os.path.dirname(os.path.abspath(__file__))
+  python = [sys.executable, os.path.join(here, 'main.py')]
+
+  def wall(cmd):
+    times = []
+    for _ in range(rounds):
+      start = perf_counter()
+      subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+      times.append(perf_counter() - start)
+    return statistics.median(times)
+
+  def command(mode):
+    return python + ['-l', 'critical', '--refresh', '0', '--rate', '0'] + (['--stream'] if mode == 'stream' else [])
+
+  print(f"startup  main.py -h {wall(python + ['-h']) * 1000:6.0f}ms"
+        f"  python -c pass {wall([sys.executable, '-c', 'pass']) * 1000:6.0f}ms, median of {rounds}")
+
+  # the CLI has no address option, the client default is port 9001
+  port = 9001
+  args = argparse.Namespace(fanout=10, latency=0, distribution='fixed', error_rate=0, change_rate=0, slow=0)
+  for count in sizes:
+    line = f"startup {count:>8} alerts" + (f"  source up {late:g}s after the engine" if late else "")
+    for mode in ('whole', 'stream'):
+      times = []
+      for _ in range(rounds):
+        server = multiprocessing.Process(target=run_server, args=[port, count, args], daemon=True)
+        if late:
+          engine = subprocess.Popen(command(mode))
+          sleep(late)
+          server.start()
+          fetch_json(f"http://127.0.0.1:{port}/stats")
+          # from the moment the source answers, what the engine's retry adds on top
+          start = perf_counter()
+        else:
+          server.start()
+          fetch_json(f"http://127.0.0.1:{port}/stats")
+          start = perf_counter()
+          engine = subprocess.Popen(command(mode))
+        while not fetch_json(f"http://127.0.0.1:{port}/stats")['counters'].get('query'):
+          sleep(0.005)
+        times.append(perf_counter() - start)
+        engine.kill()
+        engine.wait()
+        server.terminate()
+        server.join()
+      line += f"  {mode} first poll {statistics.median(times):6.2f}s"
+    print(line)
+
+
+def bench_logging(sizes, threads):
+  """ Worker-side cost of a per-alert debug line: basicConfig with f-strings and %(pathname)s,
+      against logs.setup with lazy args, a queue and a writer thread, with and without sampling
+  """
+  import logging
+  import logs
+  import os
+  from threading import Thread
+  srcfile = logging._srcfile
+  devnull = open(os.devnull, 'w')
+  logger = logging.getLogger('bench')
+
+  def eager(count):
+    for i in range(count):
+      logger.debug(f"Worker poll{i % 4:03} notify alert-{i} critical")
+
+  def lazy(count):
+    for i in range(count):
+      logger.debug("Worker poll%03d %s %s %s", i % 4, 'notify', f"alert-{i}", 'critical')
+
+  def basic(level):
+    logs.stop()
+    logging._srcfile = srcfile
+    logging.logProcesses = logging.logMultiprocessing = True
+    logging.basicConfig(stream=devnull, level=level, force=True,
+                        format='%(asctime)-30s %(levelname)-8s %(pathname)s:%(lineno)-21d %(message)s')
+
+  setups = [
+    ('basicConfig', eager, basic),
+    ('queue', lazy, lambda level: logs.setup(level, sample=0, size=10**7, stream=devnull)),
+    ('queue+sample', lazy, lambda level: logs.setup(level, sample=100, stream=devnull)),
+  ]
+  print(f"logging {threads} threads, per record in the calling thread, writer drain not counted")
+  for count in sizes:
+    per = count // threads
+    line = f"logging {count:>8} records"
+    for level in (logging.DEBUG, logging.INFO):
+      line += f"  {logging.getLevelName(level).lower():>5}:"
+      for name, emit, setup in setups:
+        setup(level)
+        workers = [Thread(target=emit, args=[per]) for _ in range(threads)]
+        start = perf_counter()
+        for w in workers:
+          w.start()
+        for w in workers:
+          w.join()
+        elapsed = perf_counter() - start
+        logs.stop()
+        line += f" {name} {elapsed / (per * threads) * 1e9:6.0f}ns"
+    print(line)
+  logging._srcfile = srcfile
+  logging.logProcesses = logging.logMultiprocessing = True
+
+
+def run_server(port, count, args):
+  """ Server process for bench load, its own interpreter so it does not steal the engine's GIL """
+  import fake_server
+  server = fake_server.serve(port, count, max(1, count // args.fanout), args.latency,
+                             args.distribution, args.error_rate, args.change_rate, args.slow)
+  server.serve_forever()
+
+
+def run_engine(port, args, conn):
+  """ Engine process for bench load: main.main as the CLI runs it, stats sent back after args.duration """
+  import main
+  import metrics
+  import os
+  import resource
+  from threading import Thread
+  config = argparse.Namespace(log='error', interval=1, retry=3, batch=args.batch, cache_size=10000,
+                              rate=args.rate, qps=args.qps, steal=args.steal, latency=1.0, snapshot='',
+                              slo=[5, 60], critical_senders=1, log_module=[], log_sample=100, log_json=False,
+                              deadband=0, concurrency=args.concurrency, dispatch=4, connect_timeout=3.05, read_timeout=10,
+                              catch_up=args.catch_up)
+  main.configure(config, (0, 1))
+  main.client.address = f"http://127.0.0.1:{port}"
+  before = resource.getrusage(resource.RUSAGE_SELF)
+  start = monotonic()
+  Thread(target=main.main, args=[1, args.concurrency, 3, args.engine, 100, 0, 4], daemon=True).start()
+  sleep(args.duration)
+  elapsed = monotonic() - start
+  after = resource.getrusage(resource.RUSAGE_SELF)
+  lag = metrics.schedule_lag
+  conn.send({
+    'polls': sum(row[-2] + sum(row[:-2]) for row in lag.values.values()),
+    'lag': {f"p{p}": lag.quantile(p / 100) for p in (50, 95, 99)},
+    'overruns': sum(metrics.tick_overruns.values.values()),
+    'stolen': sum(metrics.steals.values.values()),
+    'errors': sum(metrics.request_errors.values.values()),
+    'retries': sum(metrics.retries.values.values()),
+    'cpu': (after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime) / elapsed,
+    # kilobytes on Linux
+    'rss_mb': after.ru_maxrss / 1024,
+    'elapsed': elapsed,
+  })
+  conn.close()
+  # poll threads never return
+  os._exit(0)
+
+
+def fetch_json(url, wait=30):
+  """ GET url as JSON, retrying until the server is up """
+  from urllib.request import urlopen
+  limit = monotonic() + wait
+  while True:
+    try:
+      with urlopen(url, timeout=60) as response:
+        return json.load(response)
+    except OSError:
+      if monotonic() > limit:
+        raise
+      sleep(0.2)
+
+
+def seconds_or_na(value):
+  # nothing observed in the run, eg. no notification made it out yet
+  return '    n/a' if value is None else f"{value:6.3f}s"
+
+
+def bench_load(args):
+  """ End to end: main.main against fake_server, each in its own process, one size at a time """
+  import multiprocessing
+  print(f"load {args.engine} engine, -c {args.concurrency}{' --batch' if args.batch else ''} --rate {args.rate:g}, {args.duration}s per size,"
+        f" latency {args.latency * 1000:g}ms {args.distribution}, {args.error_rate:.1%} 500s, change rate {args.change_rate}")
+  for count in args.sizes:
+    port = args.port
+    server = multiprocessing.Process(target=run_server, args=[port, count, args], daemon=True)
+    server.start()
+    fetch_json(f"http://127.0.0.1:{port}/stats")
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    engine = multiprocessing.Process(target=run_engine, args=[port, args, sender])
+    engine.start()
+    result = receiver.recv()
+    engine.join()
+    served = fetch_json(f"http://127.0.0.1:{port}/stats")
+    server.terminate()
+    server.join()
+
+    counters, notify = served['counters'], served['notify_latency']
+    result.update(alerts=count, queries=counters.get('query', 0), peak_qps=served['peak_qps'], notifies=counters.get('notify', 0),
+                  server_500s=counters.get('500', 0), notify_latency=notify)
+    seconds = result['elapsed']
+    lag = result['lag']
+    print(f"load {count:>8} alerts  {result['polls'] / seconds:8.0f} polls/s  {result['queries'] / seconds:7.0f} queries/s (peak {result['peak_qps']:5d})"
+          f"  lag p50 {seconds_or_na(lag['p50'])} p99 {seconds_or_na(lag['p99'])}"
+          f"  notify p50 {seconds_or_na(notify.get('p50'))} p99 {seconds_or_na(notify.get('p99'))}"
+          f"  cpu {result['cpu']:5.0%}  rss {result['rss_mb']:6.0f} MB"
+          f"  {result['errors']} errors {result['retries']} retries {result['overruns']} overruns {result['stolen']} stolen")
+    if args.output:
+      with open(args.output, 'a') as f:
+        f.write(json.dumps(dict(result, engine=args.engine, concurrency=args.concurrency, batch=args.batch,
+                                latency=args.latency, distribution=args.distribution,
+                                error_rate=args.error_rate, change_rate=args.change_rate)) + '\n')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    prog='alert-exec-bench',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter
+  )
+  sub = parser.add_subparsers(dest='bench', required=True)
+  p = sub.add_parser('val2state', help="threshold evaluation, scalar vs vectorized",
+                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  p.add_argument("-s", "--sizes", help="alert counts", type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+  p.add_argument("-r", "--rounds", help="repetitions per size", type=int, default=20)
+  p = sub.add_parser('store', help="memory held per alert, setattr objects vs AlertStore",
+                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  p.add_argument("-s", "--sizes", help="alert counts", type=int, nargs='+', default=[1000, 10000, 100000])
+  p.add_argument("-t", "--targets", help="distinct query targets", type=int, default=100)
+  p = sub.add_parser('catalogue', help="startup fetch of /alerts, whole document vs streamed",
+                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  p.add_argument("-s", "--sizes", help="alert counts", type=int, nargs='+', default=[10000, 100000, 300000])
+  p.add_argument("-p", "--port", help="fake server port", type=int, default=9101)
+  p = sub.add_parser('startup', help="import time and time to first poll of the CLI against fake_server on port 9001",
+                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  p.add_argument("-s", "--sizes", help="alert counts", type=int, nargs='+', default=[1000, 100000])
+  p.add_argument("-r", "--rounds", help="runs per measurement, the median is printed", type=int, default=5)
+  p.add_argument("--late", help="seconds the metrics source starts after the engine", type=float, default=0)
+  p = sub.add_parser('logging', help="worker cost of per-alert debug logging, basicConfig vs the logs queue",
+                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  p.add_argument("-s", "--sizes", help="records per run", type=int, nargs='+', default=[10000, 100000])
+  p.add_argument("-t", "--threads", help="logging threads, like poll workers", type=int, default=4)
+  p = sub.add_parser('load', help="end to end throughput, lag, notify latency and CPU/RSS against fake_server",
+                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  p.add_argument("-s", "--sizes", help="alert counts", type=int, nargs='+', default=[1000, 10000, 100000])
+  p.add_argument("-d", "--duration", help="seconds to run each size", type=int, default=30)
+  p.add_argument("-e", "--engine", help="worker engine", type=str, choices=['thread', 'asyncio'], default='thread')
+  p.add_argument("-c", "--concurrency", help="poll workers", type=int, default=2)
+  p.add_argument("-b", "--batch", help="batched queries and posts", action="store_true")
+  p.add_argument("--rate", help="starting calls/s per backend endpoint, 0 disables the limiter so the engine alone is measured", type=float, default=100)
+  p.add_argument("--qps", help="cap on backend queries/s, 0 disables", type=float, default=0)
+  p.add_argument("--steal", help="seconds behind before idle workers steal, 0 disables", type=float, default=0.5)
+  p.add_argument("--catch-up", help="policy for polls a whole interval late", type=str,
+                 choices=['coalesce', 'skip', 'burst'], default='coalesce')
+  p.add_argument("-f", "--fanout", help="alerts per distinct query target", type=int, default=10)
+  p.add_argument("-l", "--latency", help="mean backend latency in seconds", type=float, default=0.005)
+  p.add_argument("--distribution", help="backend latency distribution", type=str,
+                 choices=['fixed', 'exponential', 'lognormal'], default='lognormal')
+  p.add_argument("--error-rate", help="share of backend calls answered 500", type=float, default=0.012)
+  p.add_argument("--change-rate", help="chance a target's value moves on each query", type=float, default=0.05)
+  p.add_argument("--slow", help="share of query targets answering 20x slower", type=float, default=0)
+  p.add_argument("-p", "--port", help="fake server port", type=int, default=9101)
+  p.add_argument("-o", "--output", help="append one JSON line per size here, to compare runs over time", type=str, default="")
+  args = parser.parse_args()
+
+  if args.bench == 'val2state':
+    bench_val2state(args.sizes, args.rounds)
+  elif args.bench == 'store':
+    bench_store(args.sizes, args.targets)
+  elif args.bench == 'catalogue':
+    bench_catalogue(args.sizes, args.port)
+  elif args.bench == 'startup':
+    bench_startup(args.sizes, args.rounds, args.late)
+  elif args.bench == 'logging':
+    bench_logging(args.sizes, args.threads)
+  elif args.bench == 'load':
+    bench_load(args)
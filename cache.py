@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+def slot_ttl(interval, tick):
+  """ Seconds a value fetched for an alert polled every `interval` seconds may be reused.
+      Half the interval, so the alert's next slot always misses and fetches, even when the
+      fetch took longer than the next poll was late. At most one `tick`, alerts sharing a
+      target in the same slot are polled within it.
+  """
+  return min(interval / 2, tick)
+
+
+class TTLCache(object):
+  """ Bounded LRU cache with a per-key time to live, shared by every poll worker.
+      Keys are query targets, each one lives slot_ttl() of the shortest intervalSecs
+      of the alerts reading it, so it serves alerts polled in the same slot, never the next one.
+  """
+  def __init__(self, maxsize=10000, default_ttl=1):
+    self.maxsize = maxsize
+    self.default_ttl = default_ttl
+    self._data = OrderedDict()
+    self._ttls = {}
+    self._lock = Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+
+  def set_ttl(self, key, ttl):
+    """ Keep the smallest ttl asked for, a key read by several alerts follows the fastest one """
+    with self._lock:
+      current = self._ttls.get(key)
+      if current is None or ttl < current:
+        self._ttls[key] = ttl
+
+  def get(self, key):
+    """ Cached value, or None if absent or expired """
+    now = monotonic()
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      value, expires = entry
+      if expires <= now:
+        del self._data[key]
+        self.expirations += 1
+        self.misses += 1
+        return None
+      # recently used to the back
+      self._data.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def put(self, key, value):
+    with self._lock:
+      self._data[key] = (value, monotonic() + self._ttls.get(key, self.default_ttl))
+      self._data.move_to_end(key)
+      # least recently used out the front
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+        self.evictions += 1
+
+  def __len__(self):
+    return len(self._data)
+
+  def stats(self):
+    """ Counters for sizing against backend QPS """
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        'size': len(self._data),
+        'maxsize': self.maxsize,
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'expirations': self.expirations,
+        'hit_ratio': self.hits / lookups if lookups else 0.0,
+      }
@@ -0,0 +1,55 @@
+#!env python3
+
+from cache import TTLCache, slot_ttl
+from time import sleep
+from unittest import mock
+import unittest
+
+
+class TestTTLCache(unittest.TestCase):
+
+  def test_hit_miss(self):
+    c = TTLCache(maxsize=10, default_ttl=60)
+    self.assertIsNone(c.get('a'))
+    c.put('a', 1)
+    self.assertEqual(c.get('a'), 1)
+    self.assertEqual((c.hits, c.misses), (1, 1))
+
+  def test_ttl_follows_smallest(self):
+    c = TTLCache(default_ttl=60)
+    c.set_ttl('a', 15)
+    c.set_ttl('a', 0.01)
+    c.set_ttl('a', 5)
+    c.put('a', 1)
+    sleep(0.02)
+    self.assertIsNone(c.get('a'))
+    self.assertEqual(c.expirations, 1)
+
+  def test_lru_eviction(self):
+    c = TTLCache(maxsize=2, default_ttl=60)
+    c.put('a', 1)
+    c.put('b', 2)
+    # touch a, so b is least recently used
+    c.get('a')
+    c.put('c', 3)
+    self.assertIsNone(c.get('b'))
+    self.assertEqual(c.get('a'), 1)
+    self.assertEqual(c.stats()['evictions'], 1)
+
+  def test_next_slot_misses(self):
+    c = TTLCache(default_ttl=60)
+    c.set_ttl('a', slot_ttl(1, 1))
+    # polled at its deadline 0, the value arrives 0.3s later
+    with mock.patch('cache.monotonic', return_value=0.3):
+      c.put('a', 1)
+    # another alert on the target in the same slot reuses it
+    with mock.patch('cache.monotonic', return_value=0.4):
+      self.assertEqual(c.get('a'), 1)
+    # the next slot at due + interval, polled right on time, fetches afresh
+    with mock.patch('cache.monotonic', return_value=1.0):
+      self.assertIsNone(c.get('a'))
+    self.assertEqual(slot_ttl(15, 1), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,41 +1,388 @@
+from time import monotonic, sleep
+import codecs
 import json
-import requests
+import metrics
+import threading
+
+
+class StatusError(ConnectionError):
+    """ Backend answered with a non-200 status """
+    def __init__(self, status):
+        super().__init__("could not complete request got " + str(status))
+        self.status = status
+
+
+def iter_json_array(chunks):
+    """ Yield the elements of a top-level JSON array one at a time from an iterable of byte chunks.
+        Only the unparsed tail of the document is held, never the whole body or the whole list.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos = "", 0
+    started = False
+    for chunk in chunks:
+        buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # element split across chunks, wait for more
+                break
+            if end == len(buf) and not isinstance(item, (dict, list)):
+                # a bare number may be cut short by the chunk boundary
+                break
+            yield item
+            pos = end
+    raise ValueError("truncated JSON array")
+
+
+def error_code(err):
+    """ Metrics label for a failed call, the HTTP status or the exception name """
+    return str(getattr(err, "status", None) or type(err).__name__)
+
+
+class _Flight:
+    """ One in-flight query, followers wait on it instead of sending their own """
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
 
 class Client:
-    def __init__(self, address):
+    """ Blocking HTTP client shared by every worker thread.
+        One keep-alive requests.Session for every thread, its pool holds up to `pool` connections,
+        one per thread that can be calling at once, so no call pays a TCP handshake after the first.
+        Every call has a (connect, read) `timeout` in seconds, a hung backend fails the call instead of the worker.
+        requests is only imported when this client is created.
+    """
+    def __init__(self, address, batch=False, batch_size=100, cache=None, limits=None, pacer=None,
+                 pool=10, timeout=(3.05, 10)):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self.timeout = timeout
         if address == "":
             address = "http://127.0.0.1:9001"
         self.address = address
+        # optional ratelimit.Limiter per endpoint, shared by every worker using this client
+        self.limits = limits or {}
+        # optional scheduler.Pacer holding backend queries to a fixed QPS across every worker
+        self.pacer = pacer
+        # optional cache.TTLCache in front of query, shared by every worker using this client
+        self.cache = cache
+        # batched /query and /notify /resolve, each switched off for good if the backend does not support it
+        self.batch = batch
+        self.batch_post = batch
+        self.batch_size = batch_size
+        # single-flight of identical targets across threads
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
 
     def query_alerts(self):
         url = self.address + "/alerts"
-        response = requests.get(url)
+        response = self.http.get(url, timeout=self.timeout)
         if response.status_code != 200:
-            raise ConnectionError("could not complete request got " + str(response.status_code))
+            raise StatusError(response.status_code)
         return response.json()
 
+    def iter_alerts(self, chunk_size=65536):
+        """ Stream the catalogue, yielding one alert dict at a time as it comes off the socket """
+        url = self.address + "/alerts"
+        with self.http.get(url, stream=True, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                raise StatusError(response.status_code)
+            yield from iter_json_array(response.iter_content(chunk_size))
+
+    def _guarded(self, endpoint, call, *args):
+        """ Pace the call through the endpoint's limiter and report how it went """
+        limiter = self.limits.get(endpoint)
+        # raises CircuitOpen rather than waiting on a dead backend
+        if limiter is not None:
+            sleep(limiter.reserve())
+        if endpoint == "query" and self.pacer is not None:
+            sleep(self.pacer.reserve())
+        start = monotonic()
+        try:
+            result = call(*args)
+        except NotImplementedError:
+            # the backend answered, just not to this form of the call, that says nothing of its health
+            if limiter is not None:
+                limiter.cancel()
+            raise
+        except Exception as err:
+            metrics.request_seconds.observe(monotonic() - start, endpoint)
+            metrics.request_errors.inc(endpoint, error_code(err))
+            if limiter is not None:
+                limiter.failure()
+            raise
+        elapsed = monotonic() - start
+        metrics.request_seconds.observe(elapsed, endpoint)
+        if limiter is not None:
+            limiter.success(elapsed)
+        return result
+
     def notify(self, alertname, message):
+        self._guarded("notify", self._notify, alertname, message)
+
+    def resolve(self, alertname):
+        self._guarded("resolve", self._resolve, alertname)
+
+    def notify_many(self, alerts):
+        """ Many (alertname, message) notifications in one POST of a JSON list """
+        request = [{"alertName": name, "message": message} for name, message in alerts]
+        self._guarded("notify", self._post_many, self.address + "/notify", request)
+
+    def resolve_many(self, alertnames):
+        """ Many resolutions in one POST of a JSON list """
+        request = [{"alertName": name} for name in alertnames]
+        self._guarded("resolve", self._post_many, self.address + "/resolve", request)
+
+    def _post_many(self, url, request):
+        response = self.http.post(url, json=request, timeout=self.timeout)
+        # a backend without list support rejects the body, rather than failing
+        if response.status_code in (400, 404, 405, 415, 422):
+            self.batch_post = False
+            raise NotImplementedError("backend does not support batched " + url)
+        if response.status_code != 200:
+            raise StatusError(response.status_code)
+
+    def _notify(self, alertname, message):
         url = self.address + "/notify"
         request = {
             "alertName": alertname,
             "message": message
         }
-        response = requests.post(url, json.dumps(request))
+        response = self.http.post(url, json=request, timeout=self.timeout)
         if response.status_code != 200:
-            raise ConnectionError("could not complete request got " + str(response.status_code))
+            raise StatusError(response.status_code)
 
-    def resolve(self, alertname):
+    def _resolve(self, alertname):
         url = self.address + "/resolve"
         request = {
             "alertName": alertname
         }
-        response = requests.post(url, json.dumps(request))
+        response = self.http.post(url, json=request, timeout=self.timeout)
         if response.status_code != 200:
-            raise ConnectionError("could not complete request got " + str(response.status_code))
+            raise StatusError(response.status_code)
 
     def query(self, target):
+        """ Identical targets already in flight on another thread share that request """
+        if self.cache is not None:
+            value = self.cache.get(target)
+            if value is not None:
+                return value
+
+        with self._lock:
+            flight = self._flights.get(target)
+            leader = flight is None
+            if leader:
+                flight = self._flights[target] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self._guarded("query", self._query, target)
+            if self.cache is not None:
+                self.cache.put(target, flight.value)
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[target]
+            flight.done.set()
+        return flight.value
+
+    def _query(self, target):
         url = self.address + "/query?target=" + target
-        response = requests.get(url)
+        response = self.http.get(url, timeout=self.timeout)
         if response.status_code != 200:
-            raise ConnectionError("could not complete request got " + str(response.status_code))
+            raise StatusError(response.status_code)
         return response.json()["value"]
+
+    def query_many(self, targets):
+        """ Values for many targets, as a dict. Targets not answered are left out for the caller to retry.
+            In batch mode targets go batch_size at a time as repeated ?target= params,
+            and a backend answering without "values" turns batching off for per-target calls.
+            Targets of a batch that failed map to None, one failed call is not turned into a
+            retried call per target while the backend struggles, they wait for their next slot.
+        """
+        values = {}
+        targets = list(dict.fromkeys(targets))
+        if self.cache is not None:
+            for target in targets:
+                value = self.cache.get(target)
+                if value is not None:
+                    values[target] = value
+            targets = [t for t in targets if t not in values]
+        if self.batch:
+            for i in range(0, len(targets), self.batch_size):
+                chunk = targets[i:i + self.batch_size]
+                try:
+                    values.update(self._guarded("query", self._query_batch, chunk))
+                except NotImplementedError:
+                    self.batch = False
+                    break
+                except Exception:
+                    values.update(dict.fromkeys(chunk))
+        for target in targets:
+            if target not in values and not self.batch:
+                try:
+                    values[target] = self.query(target)
+                except Exception:
+                    pass
+        return values
+
+    def _query_batch(self, targets):
+        if len(targets) == 1:
+            # already inside _guarded, a second pass would double reserve and trip a half-open breaker
+            value = self._query(targets[0])
+            if self.cache is not None:
+                self.cache.put(targets[0], value)
+            return {targets[0]: value}
+        url = self.address + "/query"
+        response = self.http.get(url, params=[("target", t) for t in targets], timeout=self.timeout)
+        if response.status_code != 200:
+            raise StatusError(response.status_code)
+        body = response.json()
+        if "values" not in body:
+            raise NotImplementedError("backend does not support batched query")
+        if self.cache is not None:
+            for target, value in body["values"].items():
+                self.cache.put(target, value)
+        return body["values"]
+
+
+class AsyncClient:
+    """ asyncio flavour of Client. One keep-alive connection pool shared by every
+        coroutine, with at most `limit` requests in flight at once.
+        aiohttp is only imported when this client is created.
+    """
+    def __init__(self, address, limit=100, limits=None, pacer=None, timeout=(3.05, 10)):
+        if address == "":
+            address = "http://127.0.0.1:9001"
+        self.address = address
+        # optional ratelimit.Limiter per endpoint
+        self.limits = limits or {}
+        # optional scheduler.Pacer holding backend queries to a fixed QPS
+        self.pacer = pacer
+        self.limit = limit
+        # (connect, read) seconds, like Client
+        self.timeout = timeout
+        self.session = None
+        self.inflight = None
+        # single-flight of identical targets across coroutines
+        self._flights = {}
+        self.coalesced = 0
+
+    async def open(self):
+        import aiohttp
+        import asyncio
+        connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        self.inflight = asyncio.Semaphore(self.limit)
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _guarded(self, endpoint, call, *args):
+        """ Pace the call through the endpoint's limiter and report how it went """
+        import asyncio
+        limiter = self.limits.get(endpoint)
+        # raises CircuitOpen rather than waiting on a dead backend
+        if limiter is not None:
+            await asyncio.sleep(limiter.reserve())
+        if endpoint == "query" and self.pacer is not None:
+            await asyncio.sleep(self.pacer.reserve())
+        start = monotonic()
+        try:
+            result = await call(*args)
+        except Exception as err:
+            metrics.request_seconds.observe(monotonic() - start, endpoint)
+            metrics.request_errors.inc(endpoint, error_code(err))
+            if limiter is not None:
+                limiter.failure()
+            raise
+        elapsed = monotonic() - start
+        metrics.request_seconds.observe(elapsed, endpoint)
+        if limiter is not None:
+            limiter.success(elapsed)
+        return result
+
+    async def _get(self, url, params=None):
+        async with self.inflight:
+            async with self.session.get(url, params=params) as response:
+                if response.status != 200:
+                    raise StatusError(response.status)
+                return await response.json(content_type=None)
+
+    async def _post(self, url, request):
+        async with self.inflight:
+            async with self.session.post(url, json=request) as response:
+                if response.status != 200:
+                    raise StatusError(response.status)
+
+    async def query_alerts(self):
+        return await self._get(self.address + "/alerts")
+
+    async def notify(self, alertname, message):
+        request = {
+            "alertName": alertname,
+            "message": message
+        }
+        await self._guarded("notify", self._post, self.address + "/notify", request)
+
+    async def resolve(self, alertname):
+        request = {
+            "alertName": alertname
+        }
+        await self._guarded("resolve", self._post, self.address + "/resolve", request)
+
+    async def query(self, target):
+        """ Identical targets already in flight share that request """
+        import asyncio
+        flight = self._flights.get(target)
+        if flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(flight)
+        flight = self._flights[target] = asyncio.ensure_future(self._guarded("query", self._query, target))
+        flight.add_done_callback(lambda f: self._flights.pop(target, None))
+        return await asyncio.shield(flight)
+
+    async def _query(self, target):
+        response = await self._get(self.address + "/query", params={"target": target})
+        return response["value"]
@@ -0,0 +1,164 @@
+#!env python3
+
+from client import Client, iter_json_array
+from ratelimit import Limiter
+from threading import Event, Thread
+from time import sleep
+import fake_server
+import json
+import socket
+import unittest
+
+
+def chunked(data, size):
+  return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class Response(object):
+  def __init__(self, status_code, body=None):
+    self.status_code = status_code
+    self.body = body
+
+  def json(self):
+    return self.body
+
+
+class Backend(object):
+  """ Stands in for the client's requests.Session, answers GET /query from `answer(targets)` """
+  def __init__(self, answer):
+    self.answer = answer
+    self.calls = []
+
+  def get(self, url, params=None, timeout=None):
+    targets = [t for _, t in params] if params else [url.split("target=")[1]]
+    self.calls.append(targets)
+    return self.answer(targets)
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+  def test_any_chunking(self):
+    alerts = [{'name': f"alert-{i}", 'message': 'wärning, "quoted" ]'} for i in range(50)] + [12345, [1, 2]]
+    body = json.dumps(alerts, indent=1).encode()
+    # boundaries land inside strings, numbers and multi-byte characters
+    for size in (1, 7, 64, len(body)):
+      self.assertEqual(list(iter_json_array(chunked(body, size))), alerts)
+
+  def test_empty_and_truncated(self):
+    self.assertEqual(list(iter_json_array([b' [ ] '])), [])
+    with self.assertRaises(ValueError):
+      list(iter_json_array([b'[{"name": "a"}, {"na']))
+    with self.assertRaises(ValueError):
+      list(iter_json_array([b'{"name": "a"}']))
+
+
+class TestClient(unittest.TestCase):
+
+  def test_keep_alive(self):
+    server = fake_server.serve(port=0, count=4, targets=2)
+    accepted = []
+    process_request = server.process_request
+    server.process_request = lambda request, address: accepted.append(address) or process_request(request, address)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+      client = Client(f"http://127.0.0.1:{server.server_address[1]}", pool=1)
+      self.assertEqual(len(client.query_alerts()), 4)
+      for _ in range(5):
+        client.query("test-query-0")
+        client.notify("alert-0", "warning")
+        client.resolve("alert-0")
+      self.assertEqual(server.counters['notify'], 5)
+      self.assertEqual(len(accepted), 1)
+    finally:
+      server.shutdown()
+      server.server_close()
+
+  def test_read_timeout(self):
+    # accepts the connection, never answers
+    with socket.socket() as listener:
+      listener.bind(('127.0.0.1', 0))
+      listener.listen()
+      client = Client(f"http://127.0.0.1:{listener.getsockname()[1]}", timeout=(1, 0.2))
+      with self.assertRaises(Exception) as raised:
+        client.query("test-query-0")
+      self.assertIn('Timeout', type(raised.exception).__name__)
+
+  def test_batch_single_target_half_open(self):
+    server = fake_server.serve(port=0, count=4, targets=2)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+      limiter = Limiter('query', threshold=1, open_base=0)
+      limiter.reserve()
+      limiter.failure()
+      client = Client(f"http://127.0.0.1:{server.server_address[1]}", batch=True, limits={'query': limiter})
+      # the probe is the one call a single-target chunk makes
+      self.assertIn('test-query-0', client.query_many(['test-query-0']))
+      self.assertEqual(limiter.state, Limiter.CLOSED)
+      self.assertEqual((limiter.calls, server.counters['query']), (2, 1))
+    finally:
+      server.shutdown()
+      server.server_close()
+
+  def test_unsupported_releases_probe(self):
+    limiter = Limiter('notify', threshold=1, open_base=0)
+    limiter.reserve()
+    limiter.failure()
+    client = Client('', limits={'notify': limiter})
+
+    def unsupported():
+      raise NotImplementedError("no batches")
+    with self.assertRaises(NotImplementedError):
+      client._guarded("notify", unsupported)
+    # half-open, and the next call may probe
+    self.assertEqual(limiter.state, Limiter.HALF_OPEN)
+    limiter.reserve()
+
+
+class TestQueryMany(unittest.TestCase):
+
+  def test_batch(self):
+    client = Client('', batch=True, batch_size=2)
+    # like fake_server, a single target gets the single value form
+    client.http = Backend(lambda targets: Response(200, {'values': {t: len(t) for t in targets}} if len(targets) > 1
+                                                   else {'target': targets[0], 'value': len(targets[0])}))
+    self.assertEqual(client.query_many(['a', 'bb', 'a', 'ccc']), {'a': 1, 'bb': 2, 'ccc': 3})
+    self.assertEqual(client.http.calls, [['a', 'bb'], ['ccc']])
+
+  def test_unsupported_batch_falls_back(self):
+    client = Client('', batch=True)
+    # a backend without batches answers for the first target only
+    client.http = Backend(lambda targets: Response(200, {'target': targets[0], 'value': len(targets[0])}))
+    self.assertEqual(client.query_many(['a', 'bb']), {'a': 1, 'bb': 2})
+    self.assertFalse(client.batch)
+    self.assertEqual(client.http.calls, [['a', 'bb'], ['a'], ['bb']])
+
+  def test_failed_batch_fails_its_targets(self):
+    client = Client('', batch=True)
+    client.http = Backend(lambda targets: Response(500))
+    # one call, every target waits for its next slot instead of a retried call each
+    self.assertEqual(client.query_many([f"t{i}" for i in range(100)]), {f"t{i}": None for i in range(100)})
+    self.assertEqual(len(client.http.calls), 1)
+    self.assertTrue(client.batch)
+
+  def test_coalesce_in_flight(self):
+    release = Event()
+
+    def slow(targets):
+      release.wait(5)
+      return Response(200, {'target': targets[0], 'value': 42})
+    client = Client('')
+    client.http = Backend(slow)
+    values = []
+    threads = [Thread(target=lambda: values.append(client.query('a'))) for _ in range(3)]
+    for thread in threads:
+      thread.start()
+    while client.coalesced < 2:
+      sleep(0.01)
+    release.set()
+    for thread in threads:
+      thread.join(5)
+    self.assertEqual((values, client.http.calls), ([42, 42, 42], [['a']]))
+
+
+if __name__ == '__main__':
+  unittest.main()
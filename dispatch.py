@@ -0,0 +1,265 @@
+""" Outgoing notify and resolve calls for every shard, off the poll path.
+    One lane per destination endpoint, each with its own pending set and a bounded
+    pool of sender threads. Pending entries are keyed by alert, so a repeat of the
+    same (alert, state) is dropped and a newer state replaces an older one unsent.
+    Entries are split by priority class, critical and warning, each with a latency SLO.
+    Senders serve the class whose oldest entry is closest to its deadline, and a few
+    senders per lane only ever take critical calls.
+"""
+
+from collections import OrderedDict
+from ratelimit import CircuitOpen, backoff
+from threading import Condition, Thread
+from time import monotonic, sleep
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# priority classes, most urgent first, and their default latency SLO in seconds
+CRITICAL = 'critical'
+WARNING = 'warning'
+CLASSES = (CRITICAL, WARNING)
+SLO = {CRITICAL: 5, WARNING: 60}
+
+
+def priority(item, state):
+  """ Priority class of a call about the alert in `state` """
+  return CRITICAL if state is not None and state == getattr(item, 'critical_message', None) else WARNING
+
+
+class Entry(object):
+  """ One outgoing call. previous_sec is the triggered_sec to restore if a notify never makes it.
+      queued and deadline are monotonic, the deadline is queued plus the SLO of the priority class.
+  """
+  __slots__ = ('item', 'message', 'sent_sec', 'previous_sec', 'priority', 'queued', 'deadline')
+
+  def __init__(self, item, message, sent_sec=0, previous_sec=0, priority=WARNING):
+    self.item = item
+    self.message = message
+    self.sent_sec = sent_sec
+    self.previous_sec = previous_sec
+    self.priority = priority
+    self.queued = monotonic()
+    self.deadline = None
+
+
+class Lane(object):
+  """ Pending calls for one destination, at most one per alert, oldest first within each priority class """
+  def __init__(self, name, slo=None):
+    self.name = name
+    self.slo = dict(SLO, **(slo or {}))
+    self.pending = {priority: OrderedDict() for priority in CLASSES}
+    self.cond = Condition()
+    self.sent = 0
+    self.batches = 0
+    self.failed = 0
+    self.deduplicated = 0
+    self.superseded = 0
+    self.missed = 0
+
+  def put(self, entry):
+    if entry.deadline is None:
+      entry.deadline = entry.queued + self.slo[entry.priority]
+    name = entry.item.name
+    with self.cond:
+      for priority, pending in self.pending.items():
+        current = pending.get(name)
+        if current is not None:
+          if current.message == entry.message:
+            self.deduplicated += 1
+            return
+          self.superseded += 1
+          if priority == entry.priority:
+            # same class, the newer state takes over the older one's place and deadline
+            entry.queued, entry.deadline = current.queued, current.deadline
+          else:
+            del pending[name]
+      self.pending[entry.priority][name] = entry
+      # critical-only senders wait on the same condition, wake them all to pick
+      self.cond.notify_all()
+
+  def requeue(self, entry):
+    """ Put back a deferred entry at the head of its class, unless a newer call for the alert
+        was queued while it was out. False if it was dropped.
+    """
+    name = entry.item.name
+    with self.cond:
+      if any(name in pending for pending in self.pending.values()):
+        self.superseded += 1
+        return False
+      pending = self.pending[entry.priority]
+      pending[name] = entry
+      # older than anything queued meanwhile
+      pending.move_to_end(name, last=False)
+      self.cond.notify_all()
+      return True
+
+  def cancel(self, name):
+    """ Drop an unsent call, the alert moved on """
+    with self.cond:
+      for pending in self.pending.values():
+        if pending.pop(name, None) is not None:
+          self.superseded += 1
+
+  def take(self, size, classes=CLASSES):
+    """ Block until something in classes is pending, then take up to size entries of one class.
+        Earliest deadline first: the class whose oldest entry is due soonest goes, so a fresh
+        critical overtakes a backlog of warnings, and a warning about to miss its SLO still gets its turn.
+    """
+    with self.cond:
+      while True:
+        heads = [(next(iter(self.pending[c].values())).deadline, c) for c in classes if self.pending[c]]
+        if heads:
+          break
+        self.cond.wait()
+      pending = self.pending[min(heads)[1]]
+      return [pending.popitem(last=False)[1] for _ in range(min(size, len(pending)))]
+
+  def done(self, entries):
+    """ Record delivery latency per class, and SLO misses """
+    now = monotonic()
+    for entry in entries:
+      metrics.dispatch_seconds.observe(now - entry.queued, self.name, entry.priority)
+      if now > entry.deadline:
+        self.missed += 1
+        metrics.slo_misses.inc(self.name, entry.priority)
+    self.sent += len(entries)
+
+  def stats(self):
+    with self.cond:
+      stats = {f"pending_{priority}": len(pending) for priority, pending in self.pending.items()}
+      stats.update({
+        'pending': sum(len(pending) for pending in self.pending.values()),
+        'sent': self.sent,
+        'batches': self.batches,
+        'failed': self.failed,
+        'deduplicated': self.deduplicated,
+        'superseded': self.superseded,
+        'slo_missed': self.missed,
+      })
+      return stats
+
+
+class Dispatcher(object):
+  """ notify() and resolve() return at once, sender threads make the HTTP calls """
+  def __init__(self, client, INTERVAL, RETRY, workers=4, batch_size=50, journal=None, reserved=1, slo=None):
+    self.client = client
+    self.journal = journal
+    self.INTERVAL = INTERVAL
+    self.RETRY = RETRY
+    self.workers = workers
+    # extra senders per lane taking critical calls only, warnings never have more than `workers`
+    self.reserved = reserved
+    self.batch_size = batch_size
+    self.lanes = {'notify': Lane('notify', slo), 'resolve': Lane('resolve', slo)}
+
+  def start(self):
+    for name, lane in self.lanes.items():
+      for w in range(self.workers):
+        Thread(target=self.send, name=f"dispatch-{name}{w:03}", args=[lane], daemon=True).start()
+      for w in range(self.reserved):
+        Thread(target=self.send, name=f"dispatch-{name}-critical{w:03}", args=[lane, (CRITICAL,)], daemon=True).start()
+    return self
+
+  def notify(self, item, message, previous_sec):
+    """ Queue a notification. item.triggered_sec is already set, previous_sec restores it on failure """
+    # an unsent resolve is moot once the alert fires again
+    self.lanes['resolve'].cancel(item.name)
+    self.lanes['notify'].put(Entry(item, message, item.triggered_sec, previous_sec, priority(item, message)))
+
+  def resolve(self, item, previous_state=None):
+    """ Queue a resolution. previous_state, the state being cleared, decides its class """
+    # an unsent notification is moot once the alert resolved
+    self.lanes['notify'].cancel(item.name)
+    self.lanes['resolve'].put(Entry(item, None, priority=priority(item, previous_state)))
+
+  def send(self, lane, classes=CLASSES):
+    """ Sender thread : take pending calls of the classes for the lane and deliver them """
+    while True:
+      # without batched posts one call is one entry, a sender taking more would leave the others idle
+      entries = lane.take(self.batch_size if self.client.batch_post else 1, classes)
+      sent, deferred = self.deliver(lane, entries)
+      lane.done(sent)
+      for entry in entries:
+        if entry not in sent and entry not in deferred:
+          self.failed(lane, entry)
+      if deferred:
+        # backend is down, keep them for later rather than lose them
+        logger.warning("Dispatch %s deferred %d calls, circuit open", lane.name, len(deferred))
+        for entry in reversed(deferred):
+          if self.current(lane, entry):
+            lane.requeue(entry)
+        sleep(self.INTERVAL)
+
+  def deliver(self, lane, entries):
+    """ Send entries, batched when the client supports it.
+        Returns the (sent, deferred) entries, anything else failed every attempt.
+    """
+    if self.client.batch_post and len(entries) > 1:
+      for attempt in range(self.RETRY):
+        try:
+          if lane.name == 'notify':
+            self.client.notify_many([(e.item.name, e.message) for e in entries])
+          else:
+            self.client.resolve_many([e.item.name for e in entries])
+          lane.batches += 1
+          logger.info("Dispatch %s sent batch of %d", lane.name, len(entries))
+          return entries, []
+        except CircuitOpen:
+          return [], entries
+        except NotImplementedError:
+          # client.batch_post is off now, one call each below
+          break
+        except Exception as err:
+          logger.warning("Dispatch %s failed batch attempt #%d of %d: %s", lane.name, attempt, len(entries), err)
+          if attempt + 1 < self.RETRY:
+            metrics.retries.inc(lane.name)
+          sleep(backoff(attempt, cap=self.INTERVAL))
+      else:
+        return [], []
+
+    sent = []
+    for i, entry in enumerate(entries):
+      for attempt in range(self.RETRY):
+        try:
+          if lane.name == 'notify':
+            logger.info("Dispatch notify triggered %s %s", entry.item.name, entry.message)
+            self.client.notify(entry.item.name, entry.message)
+          else:
+            logger.info("Dispatch resolve resolving attempt #%d for %s", attempt, entry.item.name)
+            self.client.resolve(entry.item.name)
+          sent.append(entry)
+          break
+        except CircuitOpen:
+          # the sent ones stay sent, the rest wait for the breaker
+          return sent, entries[i:]
+        except Exception as err:
+          logger.warning("Dispatch %s failed attempt #%d for %s: %s", lane.name, attempt, entry.item.name, err)
+          if attempt + 1 < self.RETRY:
+            metrics.retries.inc(lane.name)
+          sleep(backoff(attempt, cap=self.INTERVAL))
+    return sent, []
+
+  def current(self, lane, entry):
+    """ True if a deferred entry still says what the alert says now, a stale one is dropped """
+    if lane.name == 'notify':
+      return entry.message == entry.item.state
+    # fired again since, or dropped from the catalogue, which resolves whatever its last state
+    return entry.item.state == 'PASS' or getattr(entry.item, 'slot', 0) < 0
+
+  def failed(self, lane, entry):
+    lane.failed += 1
+    logger.error("Dispatch %s gave up on %s", lane.name, entry.item.name)
+    # not sent, so the cool-down never started. Next poll tries again
+    if lane.name == 'notify' and entry.item.triggered_sec == entry.sent_sec:
+      entry.item.triggered_sec = entry.previous_sec
+      if self.journal is not None:
+        self.journal.record(entry.item)
+
+  def stats(self):
+    stats = {}
+    for name, lane in self.lanes.items():
+      for key, val in lane.stats().items():
+        stats[f"dispatch_{name}_{key}"] = val
+    return stats
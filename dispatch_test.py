@@ -0,0 +1,159 @@
+#!env python3
+
+from dispatch import CRITICAL, WARNING, Dispatcher, Entry, Lane
+from ratelimit import CircuitOpen
+from threading import Thread
+from time import monotonic, sleep
+import unittest
+
+
+def wait_for(condition, timeout=2):
+  """ Poll condition until true, False if it never was """
+  give_up = monotonic() + timeout
+  while monotonic() < give_up:
+    if condition():
+      return True
+    sleep(0.01)
+  return False
+
+
+class Item(object):
+  def __init__(self, name, state='PASS'):
+    self.name = name
+    self.state = state
+    self.triggered_sec = 0
+
+
+class FakeClient(object):
+  batch_post = False
+
+  def __init__(self):
+    self.calls = []
+
+  def notify_many(self, alerts):
+    raise CircuitOpen("down")
+
+  def notify(self, name, message):
+    self.calls.append(('notify', name, message))
+
+  def resolve(self, name):
+    self.calls.append(('resolve', name))
+
+
+class TestLane(unittest.TestCase):
+
+  def test_dedup_and_supersede(self):
+    lane = Lane('notify')
+    a, b = Item('a'), Item('b')
+    lane.put(Entry(a, 'warning'))
+    lane.put(Entry(b, 'warning'))
+    lane.put(Entry(a, 'warning'))
+    lane.put(Entry(a, 'critical'))
+    self.assertEqual((lane.deduplicated, lane.superseded), (1, 1))
+    entries = lane.take(10)
+    self.assertEqual([(e.item.name, e.message) for e in entries], [('a', 'critical'), ('b', 'warning')])
+
+  def test_earliest_deadline_first(self):
+    lane = Lane('notify', slo={CRITICAL: 5, WARNING: 60})
+    old = Entry(Item('old'), 'warning')
+    old.queued -= 58
+    lane.put(old)
+    lane.put(Entry(Item('w'), 'warning'))
+    lane.put(Entry(Item('c'), 'critical', priority=CRITICAL))
+    # the stale warning is 2s from its SLO, the fresh critical 5s
+    self.assertEqual([e.item.name for e in lane.take(10)], ['old', 'w'])
+    self.assertEqual([e.item.name for e in lane.take(10)], ['c'])
+    lane.put(Entry(Item('w'), 'warning'))
+    lane.put(Entry(Item('c'), 'critical', priority=CRITICAL))
+    self.assertEqual([e.item.name for e in lane.take(10)], ['c'])
+
+  def test_critical_only_sender(self):
+    lane = Lane('notify')
+    lane.put(Entry(Item('w'), 'warning'))
+    taken = []
+    sender = Thread(target=lambda: taken.extend(lane.take(10, (CRITICAL,))), daemon=True)
+    sender.start()
+    sender.join(0.05)
+    self.assertEqual(taken, [])
+    lane.put(Entry(Item('c'), 'critical', priority=CRITICAL))
+    sender.join(1)
+    self.assertEqual([e.item.name for e in taken], ['c'])
+    self.assertEqual(lane.stats()['pending_warning'], 1)
+
+
+class TestDispatcher(unittest.TestCase):
+
+  def test_resolve_cancels_pending_notify(self):
+    d = Dispatcher(FakeClient(), INTERVAL=1, RETRY=1)
+    a = Item('a')
+    d.notify(a, 'warning', 0)
+    d.resolve(a)
+    self.assertEqual(d.stats()['dispatch_notify_pending'], 0)
+    self.assertEqual(d.stats()['dispatch_resolve_pending'], 1)
+
+  def test_priority_from_state(self):
+    d = Dispatcher(FakeClient(), INTERVAL=1, RETRY=1)
+    a, b = Item('a'), Item('b')
+    a.critical_message = b.critical_message = 'critical'
+    d.notify(a, 'critical', 0)
+    d.notify(b, 'warning', 0)
+    d.resolve(a, 'critical')
+    stats = d.stats()
+    self.assertEqual((stats['dispatch_notify_pending_critical'], stats['dispatch_notify_pending_warning']), (0, 1))
+    self.assertEqual(stats['dispatch_resolve_pending_critical'], 1)
+
+  def test_failed_notify_restores_cooldown(self):
+    d = Dispatcher(FakeClient(), INTERVAL=1, RETRY=1)
+    a = Item('a')
+    a.triggered_sec = 500
+    entry = Entry(a, 'warning', 500, 100)
+    d.failed(d.lanes['notify'], entry)
+    self.assertEqual(a.triggered_sec, 100)
+
+  def test_deliver_one_by_one(self):
+    client = FakeClient()
+    d = Dispatcher(client, INTERVAL=1, RETRY=1)
+    entries = [Entry(Item('a'), 'warning'), Entry(Item('b'), 'critical')]
+    sent, deferred = d.deliver(d.lanes['notify'], entries)
+    self.assertEqual((sent, deferred), (entries, []))
+    self.assertEqual(client.calls, [('notify', 'a', 'warning'), ('notify', 'b', 'critical')])
+
+  def test_requeue_keeps_newer(self):
+    lane = Lane('notify')
+    a = Item('a', 'critical')
+    deferred = Entry(a, 'warning')
+    lane.put(Entry(a, 'critical', priority=CRITICAL))
+    # the warning was out with a sender when the alert escalated
+    self.assertFalse(lane.requeue(deferred))
+    self.assertEqual([(e.item.name, e.message) for e in lane.take(10)], [('a', 'critical')])
+    # with nothing newer it goes back ahead of what was queued meanwhile
+    lane.put(Entry(Item('b'), 'warning'))
+    self.assertTrue(lane.requeue(deferred))
+    self.assertEqual([e.item.name for e in lane.take(10)], ['a', 'b'])
+
+  def test_deferred_stale_dropped(self):
+    client = FakeClient()
+    client.batch_post = True
+    d = Dispatcher(client, INTERVAL=60, RETRY=1)
+    lane = d.lanes['notify']
+    a, b = Item('a', 'warning'), Item('b', 'warning')
+    d.notify(a, 'warning', 0)
+    d.notify(b, 'warning', 0)
+    # a resolves while its notify is out on the open breaker
+    a.state = 'PASS'
+    Thread(target=d.send, args=[lane], daemon=True).start()
+    self.assertTrue(wait_for(lambda: lane.stats()['superseded'] == 0 and list(lane.pending[WARNING]) == ['b']))
+
+  def test_one_entry_per_call_unbatched(self):
+    d = Dispatcher(FakeClient(), INTERVAL=1, RETRY=1)
+    lane = d.lanes['notify']
+    for name in 'abc':
+      lane.put(Entry(Item(name), 'warning'))
+    taken = []
+    d.deliver = lambda lane, entries: taken.append(len(entries)) or (entries, [])
+    Thread(target=d.send, args=[lane], daemon=True).start()
+    self.assertTrue(wait_for(lambda: sum(taken) == 3))
+    self.assertEqual(taken, [1, 1, 1])
+
+if __name__ == '__main__':
+  unittest.main()
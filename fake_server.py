@@ -0,0 +1,215 @@
+#!env python3
+""" Local stand-in for the alerts_server container, for testing without docker.
+    Serves /alerts, /query, /notify and /resolve on :9001 like the real backend,
+    with configurable response latency, 500 rate and how often values move.
+    GET /stats has request counters and query-change-to-notify latency percentiles.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+
+
+def make_alerts(count, targets, seed=0):
+  """ Same shape as the real backend, several thresholds share each query target.
+      Seeded, so a benchmark sees the same intervals every run.
+  """
+  rng = random.Random(seed)
+  alerts = []
+  for i in range(count):
+    alerts.append({
+      'name': f"alert-{i}",
+      'query': f"test-query-{i % targets}",
+      'intervalSecs': rng.choice([5, 10, 15]),
+      'repeatIntervalSecs': 100,
+      'sustainSecs': 0,
+      'warn': {'value': 100, 'message': 'warning'},
+      'critical': {'value': 200, 'message': 'critical'},
+    })
+  return alerts
+
+
+class Handler(BaseHTTPRequestHandler):
+  """ The server instance carries alerts and counters, see serve() """
+  protocol_version = 'HTTP/1.1'
+  # headers and body go out as two writes, on a kept-alive connection Nagle holds the body
+  # back until the client's delayed ACK, 40ms on every reply
+  disable_nagle_algorithm = True
+
+  def log_message(self, format, *args):
+    # quiet, the engine logs enough
+    pass
+
+  def reply(self, code, body=None):
+    data = json.dumps(body).encode() if body is not None else b''
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def do_GET(self):
+    url = urlparse(self.path)
+    if url.path == '/alerts':
+      self.reply(200, self.server.alerts)
+    elif url.path == '/stats':
+      self.reply(200, self.server.stats())
+    elif url.path == '/query':
+      targets = parse_qs(url.query).get('target', [''])
+      self.server.count('query')
+      if self.server.fail(targets):
+        return self.reply(500)
+      # repeated ?target= is a batched query
+      if len(targets) > 1:
+        self.reply(200, {'values': {t: self.server.value(t) for t in targets}})
+      else:
+        self.reply(200, {'target': targets[0], 'value': self.server.value(targets[0])})
+    else:
+      self.reply(404)
+
+  def do_POST(self):
+    url = urlparse(self.path)
+    length = int(self.headers.get('Content-Length', 0))
+    body = json.loads(self.rfile.read(length) or b'{}')
+    if url.path in ('/notify', '/resolve'):
+      if self.server.fail():
+        self.server.count(url.path[1:])
+        return self.reply(500)
+      # a JSON list is a batch
+      for event in body if isinstance(body, list) else [body]:
+        self.server.count(url.path[1:])
+        self.server.received(url.path[1:], event)
+      self.reply(200)
+    else:
+      self.reply(404)
+
+
+def percentiles(samples, points=(50, 95, 99)):
+  """ {'p50': ..} nearest-rank percentiles of a list, plus max. Empty gives {} """
+  if not samples:
+    return {}
+  samples = sorted(samples)
+  result = {f"p{p}": samples[min(len(samples) - 1, len(samples) * p // 100)] for p in points}
+  result['max'] = samples[-1]
+  return result
+
+
+class FakeServer(ThreadingHTTPServer):
+  """ latency(): seconds to stall each query, notify and resolve. error_rate: share answered 500.
+      change_rate: chance a target's value moves on each query, 1 is a fresh random value every time.
+      slow: share of query targets answering 20x slower, the same ones every run.
+  """
+  daemon_threads = True
+  request_queue_size = 1024
+
+  def __init__(self, address, alerts, latency=None, error_rate=0, change_rate=1, slow=0):
+    super().__init__(address, Handler)
+    self.alerts = alerts
+    self.latency = latency or (lambda: 0)
+    targets = sorted({a['query'] for a in alerts})
+    self.slow = set(random.Random(0).sample(targets, int(len(targets) * slow)))
+    self.error_rate = error_rate
+    self.change_rate = change_rate
+    self.counters = {}
+    self.events = []
+    self._lock = threading.Lock()
+    self.query_of = {a['name']: a['query'] for a in alerts}
+    # target -> current value, and when it last moved
+    self.values = {}
+    self.changed = {}
+    self.notify_latency = []
+    # queries per wall-clock second, the peak is what trips a real backend
+    self.per_second = {}
+
+  def handle_error(self, request, client_address):
+    # the engine under test exits with keep-alive connections open, that is not news
+    if not isinstance(sys.exc_info()[1], ConnectionError):
+      super().handle_error(request, client_address)
+
+  def count(self, key):
+    with self._lock:
+      self.counters[key] = self.counters.get(key, 0) + 1
+      if key == 'query':
+        second = int(time.time())
+        self.per_second[second] = self.per_second.get(second, 0) + 1
+
+  def fail(self, targets=()):
+    """ Stall for the latency draw, then True for the error_rate share of calls """
+    delay = self.latency()
+    if self.slow and any(t in self.slow for t in targets):
+      delay *= 20
+    if delay > 0:
+      time.sleep(delay)
+    if random.random() < self.error_rate:
+      self.count('500')
+      return True
+    return False
+
+  def value(self, target):
+    with self._lock:
+      if target not in self.values or random.random() < self.change_rate:
+        self.values[target] = random.uniform(0, 300)
+        self.changed[target] = time.time()
+      return self.values[target]
+
+  def received(self, kind, event):
+    with self._lock:
+      self.events.append((kind, event))
+      # time from the value moving to the page, poll lag plus evaluation plus dispatch
+      changed = self.changed.get(self.query_of.get(event.get('alertName')))
+      if kind == 'notify' and changed is not None:
+        self.notify_latency.append(time.time() - changed)
+
+  def stats(self):
+    with self._lock:
+      return {'counters': dict(self.counters), 'notify_latency': percentiles(self.notify_latency),
+              'peak_qps': max(self.per_second.values(), default=0)}
+
+
+def latency_dist(mean, distribution='fixed'):
+  """ Callable drawing a response delay in seconds with the given mean """
+  if mean <= 0:
+    return lambda: 0
+  if distribution == 'exponential':
+    return lambda: random.expovariate(1 / mean)
+  if distribution == 'lognormal':
+    # sigma 1 has a long tail, mu puts the mean where asked
+    return lambda: random.lognormvariate(math.log(mean) - 0.5, 1)
+  return lambda: mean
+
+
+def serve(port=9001, count=10, targets=5, latency=0, distribution='fixed', error_rate=0, change_rate=1, slow=0):
+  """ Build a FakeServer, caller runs serve_forever() """
+  return FakeServer(('127.0.0.1', port), make_alerts(count, targets),
+                    latency_dist(latency, distribution), error_rate, change_rate, slow)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    prog='fake-alerts-server',
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter
+  )
+  parser.add_argument("-p", "--port", help="listen port", type=int, default=9001)
+  parser.add_argument("-a", "--alerts", help="number of alerts served", type=int, default=10)
+  parser.add_argument("-t", "--targets", help="number of distinct query targets", type=int, default=5)
+  parser.add_argument("-l", "--latency", help="mean response latency in seconds", type=float, default=0)
+  parser.add_argument("-d", "--distribution", help="latency distribution", type=str,
+                      choices=['fixed', 'exponential', 'lognormal'], default='fixed')
+  parser.add_argument("-e", "--error-rate", help="share of calls answered 500, the Readme measured 0.012", type=float, default=0)
+  parser.add_argument("-c", "--change-rate", help="chance a value moves on each query", type=float, default=1)
+  parser.add_argument("-s", "--slow", help="share of query targets answering 20x slower", type=float, default=0)
+  args = parser.parse_args()
+
+  server = serve(args.port, args.alerts, args.targets, args.latency, args.distribution, args.error_rate,
+                 args.change_rate, args.slow)
+  print(f"fake alerts server on :{args.port} with {args.alerts} alerts")
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server.shutdown()
@@ -0,0 +1,181 @@
+""" Logging off the hot path. Workers only build a LogRecord and put it on a bounded queue,
+    a background writer thread formats and writes it. Messages use %-style args so nothing is
+    formatted for a level that is off, or for a record the sampler drops.
+    Stdlib only, like metrics.py. A full queue drops the record rather than block a worker.
+"""
+
+from logging.handlers import QueueHandler, QueueListener
+from time import monotonic
+import atexit
+import json
+import logging
+import metrics
+import os
+import queue
+
+LEVELS = {
+  'critical': logging.CRITICAL,
+  'error': logging.ERROR,
+  'warn': logging.WARNING,
+  'warning': logging.WARNING,
+  'info': logging.INFO,
+  'debug': logging.DEBUG
+}
+
+# no %(pathname)s or %(lineno)d, finding the caller walks the stack on every record, see setup()
+FORMAT = '%(asctime)s %(levelname)-8s %(name)s %(threadName)s %(message)s'
+
+# requests logs every new connection through urllib3 at debug
+QUIET = {'urllib3': logging.WARNING, 'requests': logging.WARNING}
+
+dropped = metrics.REGISTRY.register(metrics.Counter(
+  'alert_exec_log_dropped_total', 'Log records not written, by sampling or a full queue', ('reason',)))
+
+
+def parse_level(value):
+  """ argparse type for --log-module, NAME=LEVEL """
+  name, _, level = value.partition('=')
+  if not name or level.lower() not in LEVELS:
+    raise ValueError(f"expected NAME=LEVEL with LEVEL one of {', '.join(LEVELS)}, got {value!r}")
+  return name, LEVELS[level.lower()]
+
+
+class Sampler(logging.Filter):
+  """ Passes at most `burst` records per message template every `period` seconds, below ERROR.
+      Templates are the unformatted msg, so one per-item message is one key whatever the alert.
+      The first record through after a window counts what was held back in record.suppressed.
+      Counts are approximate under races, an exact count would need a lock on every record.
+      At most `size` templates are tracked. Past that the expired windows are dropped, so a
+      caller formatting its own message, one template per record, cannot grow it for good.
+  """
+  def __init__(self, burst, period=1.0, size=10000):
+    super().__init__()
+    self.burst = burst
+    self.period = period
+    self.size = size
+    # msg template -> [window start, passed, suppressed]
+    self.windows = {}
+
+  def filter(self, record):
+    if record.levelno >= logging.ERROR:
+      return True
+    now = monotonic()
+    window = self.windows.get(record.msg)
+    if window is None and len(self.windows) >= self.size:
+      self._prune(now)
+    if window is None or now - window[0] >= self.period:
+      suppressed = window[2] if window is not None else 0
+      self.windows[record.msg] = [now, 1, 0]
+      if suppressed:
+        record.suppressed = suppressed
+      return True
+    if window[1] < self.burst:
+      window[1] += 1
+      return True
+    window[2] += 1
+    dropped.inc('sampled')
+    return False
+
+  def _prune(self, now):
+    # a new dict rather than deletes under threads still reading the old one
+    windows = {msg: window for msg, window in list(self.windows.items()) if now - window[0] < self.period}
+    self.windows = windows if len(windows) < self.size else {}
+
+
+class Handler(QueueHandler):
+  """ Enqueue without formatting, formatting happens on the writer thread.
+      Hot-path args are plain values, so a record formatted a moment later reads the same.
+      The queue is a lock-free SimpleQueue, `size` bounds it give or take a racing put.
+  """
+  def __init__(self, queue, size=10000):
+    super().__init__(queue)
+    self.size = size
+
+  def prepare(self, record):
+    return record
+
+  def handle(self, record):
+    # the queue does its own locking, skip the handler lock every worker would contend on
+    passed = self.filter(record)
+    if passed:
+      self.enqueue(record)
+    return passed
+
+  def enqueue(self, record):
+    if self.queue.qsize() >= self.size:
+      dropped.inc('full')
+      return
+    self.queue.put_nowait(record)
+
+
+class TextFormatter(logging.Formatter):
+  def format(self, record):
+    line = super().format(record)
+    suppressed = getattr(record, 'suppressed', 0)
+    return f"{line} ({suppressed} similar suppressed)" if suppressed else line
+
+
+class JsonFormatter(logging.Formatter):
+  """ One JSON object per line, for log shippers """
+  def format(self, record):
+    line = {
+      'time': record.created,
+      'level': record.levelname,
+      'logger': record.name,
+      'thread': record.threadName,
+      'message': record.getMessage(),
+    }
+    suppressed = getattr(record, 'suppressed', 0)
+    if suppressed:
+      line['suppressed'] = suppressed
+    if record.exc_info:
+      line['exception'] = self.formatException(record.exc_info)
+    return json.dumps(line)
+
+
+_listener = None
+_pid = None
+
+
+def setup(level=logging.INFO, modules=(), sample=100, json_lines=False, size=10000, stream=None):
+  """ Route every logger through one queue to a writer thread. Once per process, a forked child
+      calls it again to replace the parent's handler, whose writer thread did not survive the fork.
+      modules: (name, level) pairs over the defaults in QUIET. sample: records per message
+      template per second, 0 keeps all. size: records queued before new ones are dropped.
+  """
+  global _listener, _pid
+  if _pid == os.getpid():
+    stop()
+  root = logging.getLogger()
+  for handler in list(root.handlers):
+    root.removeHandler(handler)
+  # skip the stack walk behind %(pathname)s, %(lineno)d and %(funcName)s, the costliest part of a record,
+  # and the process fields no format here uses, see "Optimization" in the logging HOWTO
+  logging._srcfile = None
+  logging.logProcesses = False
+  logging.logMultiprocessing = False
+
+  writer = logging.StreamHandler(stream)
+  writer.setFormatter(JsonFormatter() if json_lines else TextFormatter(FORMAT))
+  records = queue.SimpleQueue()
+  handler = Handler(records, size)
+  if sample > 0:
+    handler.addFilter(Sampler(sample))
+  root.addHandler(handler)
+  root.setLevel(level)
+  for name, module_level in dict(QUIET, **dict(modules)).items():
+    logging.getLogger(name).setLevel(module_level)
+
+  _listener = QueueListener(records, writer, respect_handler_level=True)
+  _listener.start()
+  _pid = os.getpid()
+  atexit.register(stop)
+  return _listener
+
+
+def stop():
+  """ Write out what is still queued and stop the writer thread. Runs at exit """
+  global _listener
+  if _listener is not None and _pid == os.getpid():
+    _listener.stop()
+  _listener = None
@@ -0,0 +1,61 @@
+#!env python3
+
+from logs import Handler, Sampler, TextFormatter, parse_level
+import logging
+import queue
+import unittest
+
+
+def record(msg, *args, level=logging.DEBUG):
+  return logging.LogRecord('main', level, __file__, 1, msg, args, None)
+
+
+class TestSampler(unittest.TestCase):
+
+  def test_burst_per_template(self):
+    sampler = Sampler(burst=3, period=60)
+    passed = [sampler.filter(record("poll %s", f"alert-{i}")) for i in range(10)]
+    self.assertEqual(passed, [True] * 3 + [False] * 7)
+    # another template has its own budget, errors are never sampled
+    self.assertTrue(sampler.filter(record("resolve %s", "alert-0")))
+    self.assertTrue(sampler.filter(record("poll %s", "alert-0", level=logging.ERROR)))
+
+  def test_next_window_counts_suppressed(self):
+    sampler = Sampler(burst=1, period=60)
+    sampler.filter(record("poll %s", "a"))
+    sampler.filter(record("poll %s", "b"))
+    sampler.filter(record("poll %s", "c"))
+    # the window is over
+    sampler.period = 0
+    first = record("poll %s", "d")
+    self.assertTrue(sampler.filter(first))
+    self.assertEqual(first.suppressed, 2)
+    self.assertTrue(TextFormatter('%(message)s').format(first).endswith("poll d (2 similar suppressed)"))
+
+  def test_templates_bounded(self):
+    sampler = Sampler(burst=1, period=0, size=3)
+    for i in range(10):
+      self.assertTrue(sampler.filter(record(f"formatted by the caller {i}")))
+    self.assertLessEqual(len(sampler.windows), 3)
+
+
+class TestHandler(unittest.TestCase):
+
+  def test_full_queue_drops_unformatted(self):
+    records = queue.SimpleQueue()
+    handler = Handler(records, size=1)
+    handler.handle(record("poll %s", "a"))
+    handler.handle(record("poll %s", "b"))
+    self.assertEqual(records.qsize(), 1)
+    queued = records.get_nowait()
+    # formatting is left to the writer thread
+    self.assertEqual((queued.msg, queued.args), ("poll %s", ("a",)))
+
+  def test_parse_level(self):
+    self.assertEqual(parse_level("urllib3=Info"), ("urllib3", logging.INFO))
+    with self.assertRaises(ValueError):
+      parse_level("urllib3=loud")
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,215 +1,329 @@
 #!env python3
 
+from alert import RESOLVE, transition
+from cache import TTLCache, slot_ttl
 from client import Client
+from dispatch import CLASSES, Dispatcher
 from math import floor
-from queue import Queue
+import logs
+import metrics
+from ratelimit import CircuitOpen, backoff, limiters
+from scheduler import CATCH_UP, SKIP, Pacer, Scheduler, first_deadline, missed_slots, newly_missed, next_deadline
+from shard import HashRing, Partition, parse_shard
+from snapshot import Journal
+from store import AlertStore
+from supervisor import Supervisor
 from threading import Thread
-from time import time, sleep
+from time import monotonic, time, sleep
 import argparse
 import logging
 import sys
 
 
-class Alert(object):
-  """ The alert object, dynamically instantiate all class properties from creation dict """
-  def __init__(self, data):
-    # new k,v
-    self.state = 'PASS'
-    self.triggered_sec = 0
-    # all passed in k,v
-    for key in data:
-      setattr(self, key, data[key])
-
-
-def zero_or_val(val):
-  """ Returns any positive value, or zero if negative """
-  if val < 0:
-    return 0
-  else:
-    return val
-
-
-def val2state(item, value):
-  """ Compare the numeric value with the alert set-points """
-  state = None
-  # PASS (less than or equal to warn thresh)
-  if value <= item.warn['value']:
-    state = 'PASS'
-  # WARNING (greater than warn thresh, less than or equal to critical)
-  if value > item.warn['value']:
-    state = item.warn['message']
-  # CRITICAL (greater than critital)
-  if value > item.critical['value']:
-    state = item.critical['message']
-  return state
+# most alerts one poll pass takes, see steal()
+PASS_LIMIT = 100
 
 
 def poll(N):
-  """ Worker 1/3 : collect update and compare. Put alert in notifyQ
+  """ Worker : collect update and compare. State transitions become events for the dispatcher
       This is a long, complex function. Apologies in advance. 
       The reason for the lengh is many-fold. 
-      First there is the nuance of the intervalSecs, we only poll if it's our time
-      Next is the retry behavior of the poller, as the backend sometimes fails.
-      Additionally, the complex logic of state transitions is here.
+      First there is the intervalSecs, pollQ is a deadline scheduler and only hands us due alerts
+      Next alerts sharing a query target are grouped, so each target is fetched once per pass.
+      The retry behavior of the poller lives in fetch(), as the backend sometimes fails.
+      The complex logic of state transitions lives in evaluate().
+      An idle worker helps out a shard that has fallen behind, see steal().
       An attempt was made.
   """
   pollQ = queues[f"poll{N:03}"]
-  notifyQ = queues[f"notify{N:03}"]
-  resolveQ = queues[f"resolve{N:03}"]
+  shard = f"poll{N:03}"
 
   # run forever
   while True:
-    start_time = time()
-    logger.debug(f"Worker poll{N:03} there are {pollQ.qsize()} items in ueue poll{N:03}")
-    i_sleep = ( INTERVAL / pollQ.qsize() )
-    for i in range(pollQ.qsize()):
-      # get item from queue
-      item = pollQ.get()
-
-      # Check for intervalSecs, skip to next early if not our time
-      if not floor(time() % item.intervalSecs) <= INTERVAL:
-        # back on the stack
-        pollQ.put(item)
-        # skip to next item
+    due = take(N, pollQ)
+    # alerts dropped from the catalogue fall out here
+    due = [item for item in due if item.slot >= 0]
+    if not due:
+      continue
+    start = monotonic()
+    polling = []
+    for item in due:
+      # a stolen alert's lag is its own shard's
+      owner = f"poll{item.shard:03}"
+      lag = start - item.next_due
+      metrics.schedule_lag.observe(lag, owner)
+      missed = missed_slots(lag, item.intervalSecs)
+      counted = newly_missed(item, missed, CATCH_UP)
+      if counted:
+        metrics.missed_slots.inc(owner, value=counted)
+      # a whole slot behind, skip sheds this poll and waits for the alert's next slot on its grid
+      if missed and CATCH_UP == SKIP:
+        metrics.skipped_polls.inc(owner)
+        queues[owner].put(item, next_deadline(item.next_due, item.intervalSecs, start, SKIP))
         continue
+      polling.append(item)
+    due = polling
+    logger.debug("Worker poll%03d %d of %d items due", N, len(due), len(due) + pollQ.qsize())
+
+    # one query per distinct target, the value fans out to every alert that reads it
+    targets = {}
+    for item in due:
+      # the next slot for this alert, fixed rate from the last deadline so polls never drift
+      item.next_due = next_deadline(item.next_due, item.intervalSecs, start, CATCH_UP)
+      targets.setdefault(item.query, []).append(item)
+
+    # batch mode gets many targets per round trip, anything missing goes through the retry loop,
+    # targets of a failed batch come back None and wait for their next slot
+    values = client.query_many(targets) if client.batch else {}
+    if client.cache is not None and logger.isEnabledFor(logging.DEBUG):
+      logger.debug("Worker poll%03d query cache %s", N, client.cache.stats())
+
+    polled, polled_values = [], []
+    for target, items in targets.items():
+      val = values[target] if target in values else fetch(N, target)
+
+      for item in items:
+        # all attempts exhausted, try again next slot, on its own shard if it was stolen
+        if val is None:
+          queues[f"poll{item.shard:03}"].put(item, item.next_due)
+          continue
+        polled.append(item)
+        polled_values.append(val)
+
+    # one vectorized threshold pass over every alert polled this pass
+    if polled:
+      now = floor(time())
+      for item, new_state in zip(polled, store.thresholds.states(polled, polled_values)):
+        # removed by reconcile while the pass waited on the backend
+        if new_state is None:
+          continue
+        evaluate(N, item, new_state, now)
+
+    # a pass longer than INTERVAL means this shard cannot keep up, whatever the cause
+    elapsed = monotonic() - start
+    metrics.tick_seconds.observe(elapsed, shard)
+    if elapsed > INTERVAL:
+      metrics.tick_overruns.inc(shard)
+
+
+def take(N, pollQ):
+  """ Next pass for worker N. Its own due alerts first, bounded so the rest of a backlog stays
+      on the heap where idle workers can reach it. Between its own deadlines it helps the shard
+      furthest behind, else it sleeps until its earliest deadline, looking again every STEAL seconds.
+  """
+  due = pollQ.pop_due(limit=PASS_LIMIT)
+  if not due and STEAL:
+    due = steal(N)
+  if not due:
+    due = pollQ.wait_due(timeout=STEAL or None, limit=PASS_LIMIT)
+  return due
 
-      # catch unavailable backends
-      # we give ourselves a few tries
-      val = False
-      for attempt in range(RETRY):
-        if not val:
-          # get numeric value from API
-          logger.debug(f"Worker poll{N:03} query attempt #{attempt} for {item.query}")
-          # make the external call, this fails sometimes
-          try:
-            val = client.query(item.query)
-          except Exception as err:
-            logger.warning(f"Worker poll{N:03} failed query attempt #{attempt} for {item.name}: {err}")
-            # slow down the retry just a little
-            sleep(zero_or_val(i_sleep / RETRY))
-
-      # all attempts exhausted, skip to next 
-      if not val:
-        # add to back of line
-        pollQ.put(item)
-        sleep(zero_or_val(i_sleep - (time() - start_time)))
-        # we skip to next Alert
-        continue
 
-      # trasnslate numeric to string, and update triggered_sec
-      new_state = val2state(item, val)
-
-      # if not pass, stick in notify queue
-      if new_state != 'PASS':
-        logger.debug(f"Worker poll{N:03} added {item.name} to notifyQ{N:03}")
-        # update item state, reset timer
-        if item.state != new_state:
-          item.state = new_state
-          item.triggered_sec == 0
-        # Add the alert item to the notification queue
-        notifyQ.put(item)
-        # do not put item on pollQ and skip to next item
-        continue
+def steal(N):
+  """ Idle worker N : take half a pass of overdue alerts from the shard furthest behind.
+      They go back to their own shard afterwards, stealing never moves ownership.
+  """
+  now = monotonic()
+  victim, worst = None, STEAL
+  for name, q in queues.items():
+    due = q.peek()
+    if name != f"poll{N:03}" and due is not None and now - due > worst:
+      victim, worst = q, now - due
+  if victim is None:
+    return []
+  stolen = victim.pop_due(now, PASS_LIMIT // 2)
+  if stolen:
+    metrics.steals.inc(f"poll{N:03}", value=len(stolen))
+    logger.debug("Worker poll%03d stole %d alerts %.2fs overdue", N, len(stolen), worst)
+  return stolen
+
+
+def fetch(N, target):
+  """ Query one target with retries, None if every attempt failed """
+  # catch unavailable backends
+  # we give ourselves a few tries
+  for attempt in range(RETRY):
+    # get numeric value from API
+    logger.debug("Worker poll%03d query attempt #%d for %s", N, attempt, target)
+    # make the external call, this fails sometimes
+    try:
+      return client.query(target)
+    # backend is down, do not pile on, try again next slot
+    except CircuitOpen as err:
+      logger.debug("Worker poll%03d skipped query for %s: %s", N, target, err)
+      return None
+    except Exception as err:
+      logger.warning("Worker poll%03d failed query attempt #%d for %s: %s", N, attempt, target, err)
+      if attempt + 1 < RETRY:
+        metrics.retries.inc('query')
+      # jittered exponential backoff, so workers do not retry in lockstep
+      sleep(backoff(attempt, cap=INTERVAL))
+  return None
+
+
+def evaluate(N, item, new_state, now):
+  """ State transitions for one polled alert. Events go to the dispatcher, the alert back on its pollQ """
+  pollQ = queues[f"poll{item.shard:03}"]
+
+  previous_sec, previous_state = item.triggered_sec, item.state
+  event = transition(item, new_state, now)
+  if event is not None:
+    logger.debug("Worker poll%03d %s %s %s", N, event, item.name, item.state)
+    if journal is not None:
+      journal.record(item)
+  if event == RESOLVE:
+    dispatcher.resolve(item, previous_state)
+  elif event is not None:
+    # the dispatcher sends it off this thread, and restores previous_sec if it never makes it
+    dispatcher.notify(item, item.state, previous_sec)
+
+  # schedule the alert for its next deadline, a firing alert costs nothing until then
+  pollQ.put(item, item.next_due)
+
+
+def drain(catalogue):
+  """ Pop alert dicts off the list as they are consumed, so each is freed once it is built """
+  while catalogue:
+    yield catalogue.pop()
+
+
+def unavailable(attempt, error):
+  """ Wait out a failed catalogue fetch. Jittered backoff from a quarter second up to 5s,
+      so a source still coming up during a rollout costs a moment, not a fixed 30s sleep.
+  """
+  delay = backoff(attempt, base=0.25, cap=5)
+  logger.error("Metrics source %s. Retrying in %.1fs", error, delay)
+  sleep(delay)
 
-      # catch the change back from non-pass to pass
-      elif new_state == 'PASS':
-        if item.state != new_state:
-          # reset triggered sec
-          item.triggered_sec = 0
-          # set state to new
-          item.state = new_state
-          logger.debug(f"Worker poll{N:03} added {item.name} to resolveQ{N:03}")
-          # put alert on resolve queue
-          resolveQ.put(item)
-
-      # Add alert back to the end of the line
-      logger.debug(f"Worker poll{N:03} putting {item.name} back on pollQ{N:03}")
-      pollQ.put(item)
-    sleep(zero_or_val(INTERVAL - (time() - start_time)))
-
-
-def notify(N):
-  """ worker 2/3 : Send notifications. Manage cool-down timer """
-  pollQ = queues[f"poll{N:03}"]
-  notifyQ = queues[f"notify{N:03}"]
 
-  # run forever
+def fetch_alerts():
+  """ The whole /alerts catalogue, retried until the source answers with some """
+  attempt = 0
   while True:
-    start_time = time()
-
-    for i in range(notifyQ.qsize()):
-      i_sleep = ( INTERVAL / notifyQ.qsize() )
-      item = notifyQ.get()
-
-      OK = False
-      # First time, or re-trigger
-      # values of 0, or repeatIntervalSecs seconds elapsed
-      if item.triggered_sec + item.repeatIntervalSecs < floor(time()):
-        item.triggered_sec = floor(time())
-        for attempt in range(RETRY):
-
-          if not OK:
-            try:
-              logger.info(f"Worker notify{N:03} triggered {item.name} {item.state}")
-              client.notify(item.name, item.state)
-              OK = True
-
-            # Problem, tell somebody
-            except Exception as err:
-              logger.warning(f"Worker notify{N:03} failed attempt #{attempt} for {item.name}: {err}")
-              # slow down the retry just a little
-              sleep(zero_or_val(i_sleep / RETRY))
-
-      # within repeatIntervalSecs window, log if debug
-      elif item.triggered_sec + item.repeatIntervalSecs >= floor(time()):
-        logger.debug(f"Worker notify{N:03} waiting {item.name} {item.state}")
-
-      # put back on pollQ with new values
-      pollQ.put(item)
-    sleep(zero_or_val(INTERVAL - (time() - start_time)))
-
+    try:
+      catalogue = client.query_alerts()
+      if catalogue:
+        return catalogue
+      unavailable(attempt, "has no alerts")
+    except Exception as err:
+      unavailable(attempt, f"could not be contacted: {err}")
+    attempt += 1
+
+
+def stream_alerts():
+  """ Owned alert dicts straight off the /alerts socket, see client.iter_alerts.
+      A stream broken part way starts over and skips the alerts already added.
+  """
+  attempt = 0
+  while True:
+    total = 0
+    try:
+      for data in client.iter_alerts():
+        total += 1
+        if owns(data) and store.get(data['name']) is None:
+          yield data
+    except Exception as err:
+      unavailable(attempt, f"broke off the alert stream: {err}")
+      attempt += 1
+      continue
+    if total:
+      return
+    unavailable(attempt, "has no alerts")
+    attempt += 1
+
+
+def add(data, saved):
+  """ Build one alert into the store, with its query TTL and any saved state """
+  # cached values serve one slot of the fastest alert reading that target
+  if client.cache is not None:
+    client.cache.set_ttl(data['query'], slot_ttl(data['intervalSecs'], INTERVAL))
+  item = store.add(data)
+  if journal is not None:
+    journal.apply(store, item, saved)
+  return item
+
+
+def loaded(saved):
+  """ Log what the catalogue load ended with, False if this shard owns nothing """
+  if not len(store):
+    logger.error("Shard %s owns none of the alerts", partition)
+    return False
+  logger.info("There are %d alerts being watched, shard %s", len(store), partition)
+  if saved:
+    logger.info("Journal restored %d of %d saved firing alerts", sum(store.get(name) is not None for name in saved), len(saved))
+  # write our own file now, a sibling restarting meanwhile sees this P's set fill up
+  if journal is not None and journal.shard is not None:
+    journal.checkpoint(store)
+  return True
+
+
+def owns(data):
+  """ True if this process polls the alert, see --shard i/n and --processes """
+  return partition.owns(data['name'])
+
+
+def owned(catalogue):
+  """ The part of the catalogue this process polls, see --shard i/n and --processes """
+  if partition.everything():
+    return catalogue
+  return [a for a in catalogue if owns(a)]
+
+
+def reconcile(REFRESH, ring):
+  """ Background worker : re-fetch the catalogue every REFRESH seconds and apply only what changed.
+      Unchanged alerts keep their state, triggered_sec and schedule.
+  """
+  while True:
+    sleep(REFRESH)
+    try:
+      catalogue = client.query_alerts()
+    except Exception as err:
+      logger.warning("Worker reconcile failed to refresh alerts: %s", err)
+      continue
+    # an empty answer is a backend hiccup, not every alert deleted
+    if not catalogue:
+      logger.warning("Worker reconcile got an empty catalogue, keeping current alerts")
+      continue
+
+    added, removed, updated = store.reconcile(owned(catalogue))
+    for item in added + updated:
+      if client.cache is not None:
+        client.cache.set_ttl(item.query, slot_ttl(item.intervalSecs, INTERVAL))
+    for item in added:
+      # new alerts go to their poller on the hash ring
+      item.shard = ring.lookup(item.name)
+      queues[f"poll{item.shard:03}"].put(item, first_deadline(item.query, item.intervalSecs))
+    for item in removed:
+      # pollers drop it on sight (slot -1), resolve anything still firing so no page dangles
+      if item.state != 'PASS':
+        dispatcher.resolve(item, item.state)
+
+    if added or removed or updated:
+      logger.info("Worker reconcile added %d, removed %d, updated %d alerts, %d total", len(added), len(removed), len(updated), len(store))
+
+
+def checkpoint(PERIOD):
+  """ Background worker : compact the state journal every PERIOD seconds """
+  while True:
+    sleep(PERIOD)
+    try:
+      journal.checkpoint(store)
+    except Exception as err:
+      logger.warning("Worker checkpoint failed to write %s: %s", journal.path, err)
 
-def resolve(N):
-  """ worker 3/3 : send resolution signals """
-  resolveQ = queues[f"resolve{N:03}"]
 
-  # run forever
-  while True:
-    start_time = time()
-
-    for i in range(resolveQ.qsize()):
-      i_sleep = ( INTERVAL / resolveQ.qsize() )
-      item = resolveQ.get()
-      OK = False
-      # retry loop
-      for attempt in range(RETRY):
-        # Skip if we've had a success
-        if not OK:
-          try:
-            logger.info(f"Worker resolve{N:03} resolving attempt #{attempt} for {item.name}")
-            client.resolve(item.name)
-            OK = True
-          except Exception as err:
-            logger.warning(f"Worker resolve{N:03} failed attempt #{attempt} for {item.name}: {err}")
-            # slow down the retry just a little
-            sleep(zero_or_val(i_sleep / RETRY))
-
-    # wait out the duration
-    sleep(zero_or_val(INTERVAL - (time() - start_time)))
-
-
-def main(INTERVAL, CONCURRENCY, RETRY):
+def main(INTERVAL, CONCURRENCY, RETRY, ENGINE='thread', INFLIGHT=100, REFRESH=60, DISPATCH=4, SNAPSHOT=60, METRICS=0, STREAM=False):
   """ Main function: gets all alerts, creates concurrency queues, and starts workers"""
 
-  all_alerts = list()
-  while len(all_alerts) == 0:
-    try:
-      all_alerts = client.query_alerts()
-    except:
-      logging.error("Could not contact metrics source. Sleeping 30s")
-      sleep(30)
-
-  logger.info(f"There are {len(all_alerts)} total alerts being watched")
+  # scrape endpoint, gauges are read from the live structures only when scraped
+  if METRICS > 0:
+    metrics.REGISTRY.register(metrics.Gauge(
+      'alert_exec_queue_depth', 'Alerts scheduled per poll shard',
+      lambda: {(name,): q.qsize() for name, q in queues.items()}, ('shard',)))
+    metrics.REGISTRY.register(metrics.Gauge(
+      'alert_exec_stat', 'Engine, dispatcher, limiter and cache counters, see stats()',
+      lambda: {(key,): val for key, val in stats().items()}, ('name',)))
+    metrics.serve(METRICS)
 
   # sanity check the retry
   if RETRY <= 0:
@@ -226,37 +340,164 @@ def main(INTERVAL, CONCURRENCY, RETRY):
   # sanity check the concurrency
   if CONCURRENCY <= 0:
     CONCURRENCY = 1
-  elif CONCURRENCY >= len(all_alerts):
-    CONCURRENCY = len(all_alerts)
+
+  # sanity check the in-flight limit
+  if INFLIGHT <= 0:
+    INFLIGHT = 1
+
+  if STREAM:
+    # alerts go from the socket into the store one at a time, the catalogue is never whole in memory
+    logger.info("Streaming alerts, shard %s", partition)
+    all_alerts = stream_alerts()
+  else:
+    all_alerts = fetch_alerts()
+
+    # several processes split one catalogue without coordination
+    total = len(all_alerts)
+    all_alerts = owned(all_alerts)
+    if len(all_alerts) == 0:
+      logger.error("Shard %s owns none of the %d alerts", partition, total)
+      return 1
+    logger.info("Fetched %d alerts from the metrics source", total)
+
+    # no more workers than alerts
+    if CONCURRENCY >= len(all_alerts):
+      CONCURRENCY = len(all_alerts)
+    all_alerts = drain(all_alerts)
+
+  # saved lifecycle state, applied to each alert as it is added so none polls cold
+  saved = journal.load() if journal is not None else {}
+
+  # asyncio engine, coroutines over one pooled client instead of worker threads
+  if ENGINE == 'asyncio':
+    logger.info("Running Alert-Exec asyncio engine with %d requests in flight on a %ss Timer", INFLIGHT, INTERVAL)
+    logger.info("Alert-Exec using %d reties for HTTP backend", RETRY)
+    logger.info("Press Ctrl-C to exit")
+    import asyncio_engine
+    for data in all_alerts:
+      add(data, saved)
+    if not loaded(saved):
+      return 1
+    return asyncio_engine.run(store, INTERVAL, RETRY, INFLIGHT, REFRESH, client.address, client.limits, journal, SNAPSHOT,
+                             client.pacer, client.timeout, CATCH_UP, owned)
 
   # helpfun runtime banner
-  logger.info(f"Running Alert-Exec with {CONCURRENCY} workers on a {INTERVAL}s Timer")
-  logger.info(f"Alert-Exec using {RETRY} reties for HTTP backend")
+  logger.info("Running Alert-Exec with %d workers on a %ss Timer", CONCURRENCY, INTERVAL)
+  logger.info("Alert-Exec using %d reties for HTTP backend", RETRY)
   logger.info("Press Ctrl-C to exit")
 
-  # types of workers and queues
-  workers = [ 'poll', 'notify', 'resolve' ]
-  
-  # make the concurrent isolated  queues
-  for N in range(0, CONCURRENCY):
-    for worker in workers:
-      # logger.debug(f"creating Queue {worker}{N:03}")
-      queues[f"{worker}{N:03}"] = Queue()
-    # [ queues[f"{worker}{N:03}"] = Queue() for worker in workers ]
-
-  # add alerts to each poll queue fairly
-  for i in range(len(all_alerts)):
-    for N in range(0, CONCURRENCY):
-      if len(all_alerts) > 0:
-        a = all_alerts.pop()
-        logger.debug(f"PollQ{N:03} adding {a}")
-        queues[f"poll{N:03}"].put(Alert(a))
-
-  # start all the threads and pass their concurrency queue number
+  # one dispatcher for every shard, its sender threads block until a transition emits an event
+  global dispatcher
+  dispatcher = Dispatcher(client, INTERVAL, RETRY, workers=DISPATCH, journal=journal,
+                          reserved=RESERVED, slo=SLO).start()
+
+  # a deadline scheduler per poll worker
   for N in range(0, CONCURRENCY):
-    for worker in workers:
-      # logger.debug(f"starting {worker}{N:03}")
-      Thread(target=eval(worker), name=f"{worker}{N:03}", args=[N]).start() 
+    queues[f"poll{N:03}"] = Scheduler()
+
+  # add alerts to poll queues by consistent hash of the name
+  # changing concurrency only moves about 1/N of the alerts
+  # each first poll lands at a stable phase of the alert's interval, spreading backend load across it
+  # poll threads start with the first alert, the rest of the catalogue is still arriving meanwhile
+  # salted, the shard ring already cut these names and an unsalted ring of workers would repeat its cut
+  ring = HashRing(range(0, CONCURRENCY), salt='worker:')
+  for data in all_alerts:
+    a = add(data, saved)
+    a.shard = ring.lookup(a.name)
+    logger.debug("PollQ%03d adding %s", a.shard, a.name)
+    queues[f"poll{a.shard:03}"].put(a, first_deadline(a.query, a.intervalSecs))
+    if len(store) == 1:
+      # start all the poll threads and pass their concurrency queue number
+      for N in range(0, CONCURRENCY):
+        Thread(target=poll, name=f"poll{N:03}", args=[N]).start()
+  if not loaded(saved):
+    return 1
+
+  if journal is not None:
+    Thread(target=checkpoint, name="checkpoint", args=[SNAPSHOT], daemon=True).start()
+
+  # keep the catalogue current without a restart
+  if REFRESH > 0:
+    Thread(target=reconcile, name="reconcile", args=[REFRESH, ring], daemon=True).start()
+
+
+def stats():
+  """ Flat numeric snapshot of this process, summed across children by the supervisor """
+  stats = {
+    'alerts': len(store),
+    'poll_scheduled': sum(q.qsize() for q in queues.values()),
+    'poll_stolen': sum(metrics.steals.values.values()),
+    'query_coalesced': client.coalesced,
+  }
+  if dispatcher is not None:
+    stats.update(dispatcher.stats())
+  for endpoint, limiter in client.limits.items():
+    for key, val in limiter.stats().items():
+      stats[f"{endpoint}_{key}"] = val
+  if client.cache is not None:
+    cache = client.cache.stats()
+    for key in ('hits', 'misses', 'evictions', 'expirations'):
+      stats[f"cache_{key}"] = cache[key]
+  return stats
+
+
+def report(statsQ, k, PERIOD):
+  """ Child worker : send stats to the supervisor every PERIOD seconds """
+  while True:
+    sleep(PERIOD)
+    try:
+      statsQ.put((k, stats()))
+    except Exception as err:
+      logger.warning("Worker report failed to send stats: %s", err)
+
+
+def child(k, statsQ, args):
+  """ Child process k of --processes P. Polls part k of the parent shard, see shard.Partition """
+  configure(args, args.shard, (k, args.processes))
+  Thread(target=report, name="report", args=[statsQ, k, args.report], daemon=True).start()
+  # one endpoint per child, on consecutive ports
+  port = args.metrics_port + k if args.metrics_port > 0 else 0
+  sys.exit(main(args.interval, args.concurrency, args.retry, args.engine, args.inflight, args.refresh, args.dispatch, args.snapshot_interval, port, args.stream))
+
+
+def configure(args, shard, child=None):
+  """ Logging and the module globals the workers share. Once per process.
+      shard is --shard (i, n), child is (k, P) in child process k of --processes P
+  """
+  global logger, INTERVAL, RETRY, SHARD, STEAL, CATCH_UP, SLO, RESERVED, queues, partition, store, client, dispatcher, journal
+
+  # logging setup, records go through a queue to a writer thread so workers never wait on the stream
+  logs.setup(logs.LEVELS[args.log], args.log_module, args.log_sample, args.log_json)
+  logger = logging.getLogger("main")
+
+  # constants
+  INTERVAL = args.interval
+  RETRY = args.retry
+  SHARD = shard
+  STEAL = args.steal
+  CATCH_UP = args.catch_up
+  SLO = dict(zip(CLASSES, args.slo))
+  RESERVED = args.critical_senders
+
+  # globals
+  queues = {}
+  partition = Partition(SHARD, child)
+  store = AlertStore(deadband=args.deadband)
+  dispatcher = None
+  # one journal file per shard, a restarted child picks up its own alerts.
+  # a child without one yet, eg. after --processes changed, warm starts from the newest
+  # complete set of its siblings' files, restore only keeps the alerts it owns
+  journal = None
+  if args.snapshot:
+    path = args.snapshot if SHARD[1] == 1 else f"{args.snapshot}.{SHARD[0]}-{SHARD[1]}"
+    journal = Journal(path) if child is None else Journal(f"{path}.{child[0]}-{child[1]}", shard=path)
+  client = Client('', batch=args.batch,
+                  cache=TTLCache(args.cache_size) if args.cache_size > 0 else None,
+                  limits=limiters(args.rate, args.latency) if args.rate > 0 else None,
+                  pacer=Pacer(args.qps) if args.qps > 0 else None,
+                  # a pooled connection for every thread that can call at once: pollers, senders, reconcile
+                  pool=args.concurrency + 2 * (args.dispatch + args.critical_senders) + 1,
+                  timeout=(args.connect_timeout, args.read_timeout))
 
 
 if __name__ == '__main__':
@@ -271,35 +512,75 @@ if __name__ == '__main__':
                     type=int, default=1)
   parser.add_argument("-r", "--retry", help="Failure retry count",
                     type=int, default=3)
-  parser.add_argument("-l", "--log", help="logging level eg. [critical, error, warn, warning, info, debug]",
-                    type=str, default="info")
+  parser.add_argument("-e", "--engine", help="worker engine, OS threads or asyncio coroutines",
+                    type=str, choices=['thread', 'asyncio'], default="thread")
+  parser.add_argument("--inflight", help="asyncio engine limit of concurrent HTTP requests",
+                    type=int, default=100)
+  parser.add_argument("-b", "--batch", help="query many targets per request, falls back to one per target if unsupported",
+                    action="store_true")
+  parser.add_argument("--stream", help="parse /alerts incrementally off the socket into the store, polling starts with the first alert",
+                    action="store_true")
+  parser.add_argument("--cache-size", help="query result cache entries shared by poll workers, 0 disables",
+                    type=int, default=10000)
+  parser.add_argument("--refresh", help="seconds between re-fetching the alert catalogue, 0 disables",
+                    type=int, default=60)
+  parser.add_argument("-s", "--shard", help="poll only shard i of n of the catalogue, split by consistent hash of alert name",
+                    type=parse_shard, default="0/1")
+  parser.add_argument("--deadband", help="percent under its set-point a firing level clears at, for alerts without their own clear value or deadbandPct",
+                    type=float, default=0)
+  parser.add_argument("--catch-up", help="alerts polled a whole interval late: coalesce the missed slots into one poll, skip the late poll, or burst one poll per missed slot",
+                    type=str, choices=CATCH_UP, default="coalesce")
+  parser.add_argument("--steal", help="seconds a shard may fall behind before idle poll workers take its due alerts. 0 disables",
+                    type=float, default=0.5)
+  parser.add_argument("-d", "--dispatch", help="sender threads per notify and resolve lane",
+                    type=int, default=4)
+  parser.add_argument("--critical-senders", help="extra sender threads per lane which only deliver critical alerts",
+                    type=int, default=1)
+  parser.add_argument("--slo", help="seconds a critical and a warning notification may wait for a sender, the most overdue class goes first",
+                    type=float, nargs=2, metavar=('CRITICAL', 'WARNING'), default=[5, 60])
+  parser.add_argument("--rate", help="starting calls/s per backend endpoint, adapts to 500s and latency. 0 disables",
+                    type=float, default=100)
+  parser.add_argument("--qps", help="cap on backend queries/s per process, shared by every poll worker. 0 disables",
+                    type=float, default=0)
+  parser.add_argument("--connect-timeout", help="seconds to wait for a backend connection before the call fails",
+                    type=float, default=3.05)
+  parser.add_argument("--read-timeout", help="seconds to wait on a backend response before the call fails",
+                    type=float, default=10)
+  parser.add_argument("--latency", help="seconds a backend call may take before the rate backs off",
+                    type=float, default=1.0)
+  parser.add_argument("-p", "--processes", help="child processes, each polling its own sub-shard under a supervisor",
+                    type=int, default=1)
+  parser.add_argument("--report", help="seconds between stats reports from child processes",
+                    type=int, default=30)
+  parser.add_argument("--snapshot", help="journal file of alert state for a warm restart, empty disables",
+                    type=str, default="")
+  parser.add_argument("--snapshot-interval", help="seconds between compacting the state journal",
+                    type=int, default=60)
+  parser.add_argument("-m", "--metrics-port", help="serve Prometheus metrics on 127.0.0.1:PORT/metrics, child k of --processes on PORT+k. 0 disables",
+                    type=int, default=0)
+  parser.add_argument("-l", "--log", help="logging level",
+                    type=str.lower, choices=list(logs.LEVELS), default="info")
+  parser.add_argument("--log-module", help="logging level of one module, eg. dispatch=debug or urllib3=info. Repeatable",
+                    type=logs.parse_level, action="append", default=[], metavar="NAME=LEVEL")
+  parser.add_argument("--log-sample", help="records per second written for each repeated message below error, 0 keeps all",
+                    type=int, default=100)
+  parser.add_argument("--log-json", help="write log records as JSON lines",
+                    action="store_true")
   args = parser.parse_args()
 
-  levels = {
-    'critical': logging.CRITICAL,
-    'error': logging.ERROR,
-    'warn': logging.WARNING,
-    'warning': logging.WARNING,
-    'info': logging.INFO,
-    'debug': logging.DEBUG
-  }
-  level = levels.get(args.log.lower())
-  
-  # logging setup
-  format = '%(asctime)-30s %(levelname)-8s %(pathname)s:%(lineno)-21d %(message)s'
-  logger = logging.getLogger(__name__)
-  logging.basicConfig(format=format, level=level)
-
-  # constants
-  CONCURRENCY = args.concurrency
-  INTERVAL = args.interval
-  RETRY = args.retry
+  # multi-process mode, each child runs its own sub-shard in its own interpreter
+  if args.processes > 1:
+    configure(args, args.shard)
+    supervisor = Supervisor(args.processes, child, args=[args], report=args.report)
+    try:
+      supervisor.run()
+    except KeyboardInterrupt:
+      supervisor.stop()
+      sys.exit('Ctrl-C pressed ...')
 
-  # globals
-  queues = {}
-  client = Client('')
+  configure(args, args.shard)
 
   try:
-    exit(main(INTERVAL, CONCURRENCY, RETRY))
+    exit(main(args.interval, args.concurrency, args.retry, args.engine, args.inflight, args.refresh, args.dispatch, args.snapshot_interval, args.metrics_port, args.stream))
   except KeyboardInterrupt:
     sys.exit('Ctrl-C pressed ...')
@@ -0,0 +1,193 @@
+""" Prometheus-style counters and histograms for the hot path, and a tiny /metrics endpoint.
+    Recording is a dict lookup and an add under a per-metric lock, no formatting happens
+    until a scrape. Stdlib only, the text format is simple enough to write by hand.
+    http.server is only imported when the endpoint is served.
+"""
+
+from bisect import bisect_left
+from threading import Lock, Thread
+import logging
+
+logger = logging.getLogger(__name__)
+
+# seconds, from a fast local call to a backend at its timeout
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# seconds behind schedule, from on time to several of the longest intervals
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120)
+
+
+def _labels(names, values):
+  if not names:
+    return ''
+  return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+
+class Counter(object):
+  """ Monotonic count per label values, inc('query') for labels=('endpoint',) """
+  kind = 'counter'
+
+  def __init__(self, name, help, labels=()):
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self.values = {}
+    self._lock = Lock()
+
+  def inc(self, *labels, value=1):
+    with self._lock:
+      self.values[labels] = self.values.get(labels, 0) + value
+
+  def samples(self):
+    with self._lock:
+      values = list(self.values.items())
+    return [(self.name, _labels(self.labels, k), v) for k, v in values]
+
+
+class Histogram(object):
+  """ Cumulative buckets, sum and count per label values """
+  kind = 'histogram'
+
+  def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self.buckets = tuple(buckets)
+    # label values -> [per-bucket counts..., +Inf count, sum]
+    self.values = {}
+    self._lock = Lock()
+
+  def observe(self, value, *labels):
+    i = bisect_left(self.buckets, value)
+    with self._lock:
+      row = self.values.get(labels)
+      if row is None:
+        row = self.values[labels] = [0] * (len(self.buckets) + 2)
+      row[i] += 1
+      row[-1] += value
+
+  def quantile(self, q):
+    """ Estimate over every label set, interpolating inside the bucket like histogram_quantile().
+        Past the last bound gives that bound, None before the first observation.
+    """
+    with self._lock:
+      rows = [list(row) for row in self.values.values()]
+    counts = [sum(col) for col in zip(*rows)][:-1]
+    total = sum(counts)
+    if not total:
+      return None
+    rank = q * total
+    running, lower = 0, 0
+    for bound, count in zip(self.buckets, counts):
+      if running + count >= rank and count:
+        return lower + (bound - lower) * (rank - running) / count
+      running += count
+      lower = bound
+    return self.buckets[-1]
+
+  def samples(self):
+    with self._lock:
+      values = [(k, list(row)) for k, row in self.values.items()]
+    samples = []
+    for k, row in values:
+      running = 0
+      for bound, count in zip(self.buckets + ('+Inf',), row):
+        running += count
+        le = _labels(self.labels + ('le',), k + (bound,))
+        samples.append((self.name + '_bucket', le, running))
+      samples.append((self.name + '_sum', _labels(self.labels, k), row[-1]))
+      samples.append((self.name + '_count', _labels(self.labels, k), running))
+    return samples
+
+
+class Gauge(object):
+  """ Read at scrape time from fn(), which returns {label values tuple: value} """
+  kind = 'gauge'
+
+  def __init__(self, name, help, fn, labels=()):
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self.fn = fn
+
+  def samples(self):
+    return [(self.name, _labels(self.labels, k), v) for k, v in self.fn().items()]
+
+
+class Registry(object):
+  """ Metrics by name, rendered in the Prometheus text exposition format """
+  def __init__(self):
+    self.metrics = {}
+
+  def register(self, metric):
+    self.metrics[metric.name] = metric
+    return metric
+
+  def render(self):
+    lines = []
+    for metric in list(self.metrics.values()):
+      try:
+        samples = metric.samples()
+      except Exception as err:
+        logger.warning("Metrics could not collect %s: %s", metric.name, err)
+        continue
+      lines.append(f"# HELP {metric.name} {metric.help}")
+      lines.append(f"# TYPE {metric.name} {metric.kind}")
+      for name, labels, value in samples:
+        lines.append(f"{name}{labels} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+request_seconds = REGISTRY.register(Histogram(
+  'alert_exec_request_seconds', 'Backend call latency, failures included', ('endpoint',)))
+request_errors = REGISTRY.register(Counter(
+  'alert_exec_request_errors_total', 'Failed backend calls by HTTP status or exception', ('endpoint', 'code')))
+retries = REGISTRY.register(Counter(
+  'alert_exec_retries_total', 'Backend calls retried after a failure', ('endpoint',)))
+tick_seconds = REGISTRY.register(Histogram(
+  'alert_exec_tick_seconds', 'Time to poll and evaluate one pass of due alerts', ('shard',)))
+tick_overruns = REGISTRY.register(Counter(
+  'alert_exec_tick_overruns_total', 'Passes that took longer than INTERVAL', ('shard',)))
+steals = REGISTRY.register(Counter(
+  'alert_exec_steals_total', 'Overdue alerts an idle poll worker took from another shard', ('shard',)))
+dispatch_seconds = REGISTRY.register(Histogram(
+  'alert_exec_dispatch_seconds', 'Time from a notify or resolve being queued to its delivery', ('lane', 'class')))
+slo_misses = REGISTRY.register(Counter(
+  'alert_exec_slo_misses_total', 'Calls delivered after their priority class latency SLO', ('lane', 'class')))
+deadband_suppressed = REGISTRY.register(Counter(
+  'alert_exec_deadband_suppressed_total', 'Levels held over by the deadband that went back over, a resolve and re-notify saved', ('level',)))
+schedule_lag = REGISTRY.register(Histogram(
+  'alert_exec_schedule_lag_seconds', 'Delay between an alert falling due and its poll starting', ('shard',), LAG_BUCKETS))
+missed_slots = REGISTRY.register(Counter(
+  'alert_exec_missed_slots_total', 'Alert intervals that went by while a late poll waited, see --catch-up', ('shard',)))
+skipped_polls = REGISTRY.register(Counter(
+  'alert_exec_skipped_polls_total', 'Polls a whole interval late not made under --catch-up skip', ('shard',)))
+
+
+def serve(port, registry=REGISTRY, host='127.0.0.1'):
+  """ Serve GET /metrics from a daemon thread, returns the server """
+  from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+  class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path.split('?')[0] != '/metrics':
+        self.send_error(404)
+        return
+      body = self.server.registry.render().encode()
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/plain; version=0.0.4')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      # scrapes are not worth a log line each
+      pass
+
+  server = ThreadingHTTPServer((host, port), Handler)
+  server.daemon_threads = True
+  server.registry = registry
+  Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+  logger.info("Metrics on http://%s:%d/metrics", host, port)
+  return server
@@ -0,0 +1,41 @@
+#!env python3
+
+from metrics import Counter, Gauge, Histogram, Registry
+import unittest
+
+
+class TestMetrics(unittest.TestCase):
+
+  def test_render(self):
+    registry = Registry()
+    errors = registry.register(Counter('errors_total', 'Errors', ('endpoint', 'code')))
+    latency = registry.register(Histogram('latency_seconds', 'Latency', ('endpoint',), buckets=(0.1, 1)))
+    registry.register(Gauge('depth', 'Depth', lambda: {('poll000',): 3}, ('shard',)))
+    errors.inc('query', '500')
+    errors.inc('query', '500')
+    for value in (0.05, 0.5, 0.7, 5):
+      latency.observe(value, 'query')
+    text = registry.render()
+    self.assertIn('# TYPE errors_total counter', text)
+    self.assertIn('errors_total{endpoint="query",code="500"} 2', text)
+    self.assertIn('latency_seconds_bucket{endpoint="query",le="0.1"} 1', text)
+    self.assertIn('latency_seconds_bucket{endpoint="query",le="1"} 3', text)
+    self.assertIn('latency_seconds_bucket{endpoint="query",le="+Inf"} 4', text)
+    self.assertIn('latency_seconds_count{endpoint="query"} 4', text)
+    self.assertIn('depth{shard="poll000"} 3', text)
+
+  def test_quantile(self):
+    latency = Histogram('latency_seconds', 'Latency', ('shard',), buckets=(1, 2, 4))
+    self.assertIsNone(latency.quantile(0.5))
+    for value in (0.5, 0.5, 1.5, 3):
+      latency.observe(value, 'poll000')
+    latency.observe(3, 'poll001')
+    # merged across shards, rank 2.5 of 5 lands half way through the (1, 2] bucket
+    self.assertAlmostEqual(latency.quantile(0.5), 1.5)
+    self.assertAlmostEqual(latency.quantile(1), 4)
+    latency.observe(100, 'poll001')
+    self.assertEqual(latency.quantile(1), 4)
+
+
+if __name__ == '__main__':
+  unittest.main()
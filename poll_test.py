@@ -0,0 +1,59 @@
+#!env python3
+
+from scheduler import Scheduler
+from time import monotonic
+import importlib.util
+import logging
+import metrics
+import os
+import unittest
+
+# the original template under interviews-alerts-execution-engine-master has a main.py of its own,
+# whichever test imports `main` first wins, so load this one by path
+spec = importlib.util.spec_from_file_location('alert_exec_main', os.path.join(os.path.dirname(__file__), 'main.py'))
+main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(main)
+
+
+class Item(object):
+  def __init__(self, name):
+    self.name = name
+
+
+class TestSteal(unittest.TestCase):
+
+  def setUp(self):
+    main.logger = logging.getLogger("main")
+    main.STEAL = 0.5
+    now = monotonic()
+    main.queues = {f"poll{N:03}": Scheduler() for N in range(3)}
+    # poll000 is busy, but its next alert is a minute out
+    main.queues["poll000"].put(Item('own'), now + 60)
+    # poll001 is 2s behind, poll002 only a little
+    self.behind = [Item(f"behind-{i}") for i in range(main.PASS_LIMIT)]
+    for item in self.behind:
+      main.queues["poll001"].put(item, now - 2)
+    main.queues["poll002"].put(Item('late'), now - 0.1)
+
+  def test_steal_from_furthest_behind(self):
+    stolen = metrics.steals.values.get(("poll000",), 0)
+    self.assertEqual(main.steal(0), self.behind[:main.PASS_LIMIT // 2])
+    self.assertEqual(metrics.steals.values[("poll000",)] - stolen, main.PASS_LIMIT // 2)
+    # within --steal of its deadline a shard is left alone
+    main.queues["poll001"].pop_due()
+    self.assertEqual(main.steal(0), [])
+    self.assertEqual(main.queues["poll002"].qsize(), 1)
+
+  def test_take_between_own_deadlines(self):
+    # a worker whose own alert is not due yet helps out, without waiting out an idle timeout first
+    start = monotonic()
+    self.assertEqual(main.take(0, main.queues["poll000"]), self.behind[:main.PASS_LIMIT // 2])
+    self.assertLess(monotonic() - start, 0.1)
+    # its own due alerts go first
+    mine = Item('mine')
+    main.queues["poll000"].put(mine, monotonic() - 1)
+    self.assertEqual(main.take(0, main.queues["poll000"]), [mine])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,152 @@
+""" Backend protection shared by every worker. One Limiter per endpoint (query, notify, resolve):
+    an AIMD token bucket that slows down when too many calls in a window fail or answer slowly,
+    in front of a circuit breaker that stops calling a failing backend for a jittered, growing pause.
+"""
+
+from threading import Lock
+from time import monotonic
+import random
+
+
+class CircuitOpen(Exception):
+  """ The endpoint's breaker is open, the call was not attempted """
+  pass
+
+
+def backoff(attempt, base=0.05, cap=30):
+  """ Full jitter exponential backoff, spreads retries of many workers apart """
+  return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class Limiter(object):
+  """ Token bucket with additive increase, multiplicative decrease, plus a circuit breaker.
+      reserve() before a call and success()/failure() after it.
+      The rate moves once per `window` seconds from the share of bad calls in it, 500s and answers
+      slower than `latency`. Over `max_bad` with at least `min_calls` calls it halves, otherwise it
+      grows by `step` calls/s, a tenth of the starting rate. A stray 500 from a backend with a
+      steady background error rate is not a signal.
+  """
+  CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+  def __init__(self, name, rate=100, min_rate=1, max_rate=10000, burst=10,
+               latency=1.0, threshold=5, open_base=1, open_cap=60, window=1, max_bad=0.1, min_calls=10):
+    self.name = name
+    # token bucket, rate in calls per second
+    self.rate = rate
+    self.min_rate = min_rate
+    self.max_rate = max_rate
+    self.burst = burst
+    self.tokens = burst
+    self.latency = latency
+    self._last = monotonic()
+    # AIMD window, calls and bad calls since _window_start
+    self.window = window
+    self.max_bad = max_bad
+    self.min_calls = min_calls
+    self.step = max(1, rate / 10)
+    self._window_start = self._last
+    self._outcomes = 0
+    self._bad = 0
+    # circuit breaker
+    self.state = self.CLOSED
+    self.threshold = threshold
+    self.open_base = open_base
+    self.open_cap = open_cap
+    self.failures = 0
+    self.opens = 0
+    self.open_until = 0
+    self._probing = False
+    # counters
+    self.calls = 0
+    self.errors = 0
+    self.rejected = 0
+    self._lock = Lock()
+
+  def reserve(self):
+    """ Seconds the caller must sleep before its call, raises CircuitOpen instead of waiting on a dead backend """
+    with self._lock:
+      now = monotonic()
+      if self.state == self.OPEN:
+        if now < self.open_until:
+          self.rejected += 1
+          raise CircuitOpen(f"{self.name} circuit open for another {self.open_until - now:.1f}s")
+        self.state = self.HALF_OPEN
+        self._probing = False
+      if self.state == self.HALF_OPEN:
+        # one probe at a time decides whether the backend is back
+        if self._probing:
+          self.rejected += 1
+          raise CircuitOpen(f"{self.name} circuit half-open, probe in flight")
+        self._probing = True
+
+      self.tokens = min(self.burst, self.tokens + (now - self._last) * self.rate)
+      self._last = now
+      self.tokens -= 1
+      self.calls += 1
+      # negative tokens are callers queued behind us
+      return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+  def success(self, elapsed):
+    with self._lock:
+      self.failures = 0
+      if self.state == self.HALF_OPEN:
+        self.state = self.CLOSED
+        self.opens = 0
+        self._probing = False
+      # slow answers are the first sign of a struggling backend
+      self._outcome(elapsed > self.latency)
+
+  def failure(self):
+    with self._lock:
+      self.errors += 1
+      self.failures += 1
+      self._outcome(True)
+      if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+        self._open()
+
+  def cancel(self):
+    """ A call which tells nothing about the backend's health, eg. an unsupported request form.
+        Lets go of a half-open probe so the next call can decide.
+    """
+    with self._lock:
+      self._probing = False
+
+  def _outcome(self, bad):
+    # count the call, and at the end of a window adjust the rate from its bad share
+    self._outcomes += 1
+    self._bad += bad
+    now = monotonic()
+    if now - self._window_start < self.window:
+      return
+    if self._bad > self.max_bad * self._outcomes:
+      # too few calls to tell noise from a brownout leaves the rate alone, the breaker covers a dead backend
+      if self._outcomes >= self.min_calls:
+        self.rate = max(self.min_rate, self.rate / 2)
+    else:
+      self.rate = min(self.max_rate, self.rate + self.step)
+    self._window_start = now
+    self._outcomes = self._bad = 0
+
+  def _open(self):
+    # equal jitter, half fixed so the pause never collapses to nothing
+    pause = min(self.open_cap, self.open_base * 2 ** self.opens)
+    pause = pause / 2 + random.uniform(0, pause / 2)
+    self.state = self.OPEN
+    self.open_until = monotonic() + pause
+    self.opens += 1
+    self._probing = False
+
+  def stats(self):
+    with self._lock:
+      return {
+        'rate': self.rate,
+        'open': 0 if self.state == self.CLOSED else 1,
+        'calls': self.calls,
+        'errors': self.errors,
+        'rejected': self.rejected,
+      }
+
+
+def limiters(rate, latency):
+  """ One Limiter per backend endpoint """
+  return {name: Limiter(name, rate=rate, latency=latency) for name in ('query', 'notify', 'resolve')}
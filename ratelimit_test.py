@@ -0,0 +1,74 @@
+#!env python3
+
+from ratelimit import Limiter, CircuitOpen, backoff
+import unittest
+
+
+class TestLimiter(unittest.TestCase):
+
+  def test_bucket_paces(self):
+    limiter = Limiter('query', rate=10, burst=2)
+    waits = [limiter.reserve() for _ in range(4)]
+    self.assertEqual(waits[:2], [0, 0])
+    # third and fourth wait for refill at 10/s
+    self.assertAlmostEqual(waits[2], 0.1, places=2)
+    self.assertAlmostEqual(waits[3], 0.2, places=2)
+
+  def test_aimd(self):
+    limiter = Limiter('query', rate=100, window=0, min_calls=10)
+    limiter.success(0.01)
+    self.assertEqual(limiter.rate, 110)
+    # a window of one failure is too few calls to judge
+    limiter.failure()
+    self.assertEqual(limiter.rate, 110)
+
+  def test_error_ratio_window(self):
+    limiter = Limiter('query', rate=100, window=60, max_bad=0.1, threshold=100)
+    # a steady 5% of 500s, the window closes on the 40th call
+    for i in range(40):
+      limiter.window = 0 if i == 39 else 60
+      if i % 20 == 0:
+        limiter.failure()
+      else:
+        limiter.success(0.01)
+    self.assertEqual(limiter.rate, 110)
+    # a brownout, a fifth of calls failing or slow
+    for i in range(40):
+      limiter.window = 0 if i == 39 else 60
+      if i % 10 == 0:
+        limiter.failure()
+      elif i % 10 == 1:
+        limiter.success(5)
+      else:
+        limiter.success(0.01)
+    self.assertEqual(limiter.rate, 55)
+
+  def test_breaker(self):
+    limiter = Limiter('notify', threshold=3, open_base=0)
+    for _ in range(3):
+      limiter.reserve()
+      limiter.failure()
+    self.assertEqual(limiter.state, Limiter.OPEN)
+    # pause of zero, straight to half-open with one probe allowed
+    limiter.reserve()
+    self.assertEqual(limiter.state, Limiter.HALF_OPEN)
+    with self.assertRaises(CircuitOpen):
+      limiter.reserve()
+    limiter.success(0.01)
+    self.assertEqual(limiter.state, Limiter.CLOSED)
+
+  def test_breaker_rejects_while_open(self):
+    limiter = Limiter('resolve', threshold=1, open_base=60)
+    limiter.reserve()
+    limiter.failure()
+    with self.assertRaises(CircuitOpen):
+      limiter.reserve()
+    self.assertEqual(limiter.stats()['rejected'], 1)
+
+  def test_backoff_bounds(self):
+    for attempt in range(10):
+      self.assertLessEqual(backoff(attempt, base=0.1, cap=2), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
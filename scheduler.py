@@ -0,0 +1,154 @@
+from shard import stable_hash
+from threading import Condition, Lock
+from time import monotonic, time
+import heapq
+import itertools
+
+
+class Scheduler(object):
+  """ Deadline ordered min-heap of alerts, one per poll worker.
+      Each item carries a `next_due` monotonic deadline. Workers block until the
+      earliest deadline arrives, then pop only the items which are due.
+      Idle alerts are never touched between their deadlines.
+  """
+  def __init__(self):
+    self._heap = []
+    # tie-breaker, keeps FIFO order for equal deadlines and avoids comparing items
+    self._seq = itertools.count()
+    self._cond = Condition()
+
+  def qsize(self):
+    """ Number of scheduled items, same name as Queue.qsize for drop-in use """
+    return len(self._heap)
+
+  def put(self, item, due=None):
+    """ Schedule item for monotonic time `due`. Defaults to now """
+    if due is None:
+      due = monotonic()
+    item.next_due = due
+    with self._cond:
+      heapq.heappush(self._heap, (due, next(self._seq), item))
+      # only wake the worker if this item is now the earliest deadline
+      if self._heap[0][2] is item:
+        self._cond.notify_all()
+
+  def peek(self):
+    """ Earliest deadline, or None if empty """
+    with self._cond:
+      if self._heap:
+        return self._heap[0][0]
+      return None
+
+  def pop_due(self, now=None, limit=None):
+    """ Non-blocking. Pop every item whose deadline is <= now, earliest first, at most limit """
+    if now is None:
+      now = monotonic()
+    with self._cond:
+      return self._pop_locked(now, limit)
+
+  def wait_due(self, timeout=None, limit=None):
+    """ Block until the earliest deadline arrives, then pop every due item, at most limit.
+        Returns an empty list if timeout expires first.
+    """
+    give_up = None if timeout is None else monotonic() + timeout
+    with self._cond:
+      while True:
+        now = monotonic()
+        if self._heap and self._heap[0][0] <= now:
+          break
+        # sleep until the earliest deadline, the caller's limit, or a new earlier put()
+        wake = self._heap[0][0] if self._heap else None
+        if give_up is not None:
+          if now >= give_up:
+            return []
+          wake = give_up if wake is None else min(wake, give_up)
+        self._cond.wait(None if wake is None else wake - now)
+      return self._pop_locked(now, limit)
+
+  def _pop_locked(self, now, limit=None):
+    """ Pop due items, caller must hold the condition lock """
+    due = []
+    while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+      due.append(heapq.heappop(self._heap)[2])
+    return due
+
+
+# catch-up policies for an alert whose poll came a whole interval or more late, see --catch-up
+COALESCE = 'coalesce'
+SKIP = 'skip'
+BURST = 'burst'
+CATCH_UP = (COALESCE, SKIP, BURST)
+
+
+def missed_slots(lag, interval):
+  """ Slots after the one being served that went by while it waited, `lag` seconds late """
+  if interval <= 0 or lag < interval:
+    return 0
+  return int(lag // interval)
+
+
+def newly_missed(item, missed, policy=COALESCE):
+  """ Of the `missed` slots a late poll of item found, those no earlier poll counted.
+      Burst polls the missed slots back to back, each of those polls is late too and finds
+      the same slots less one, item.behind keeps what the last poll found.
+  """
+  if policy != BURST:
+    return missed
+  counted = max(0, item.behind - 1)
+  item.behind = missed
+  return max(0, missed - counted)
+
+
+def next_deadline(due, interval, now=None, policy=COALESCE):
+  """ Advance a deadline by one interval without drift.
+      If the worker fell so far behind that the next slot is already gone, coalesce and skip go
+      to the first slot still ahead on the alert's own grid, so its phase is kept. Burst keeps
+      every slot, the alert is polled back to back until it has caught up.
+  """
+  if now is None:
+    now = monotonic()
+  if interval <= 0:
+    return now
+  due += interval
+  if due <= now and policy != BURST:
+    due += ((now - due) // interval + 1) * interval
+  return due
+
+
+def first_deadline(key, interval, now=None):
+  """ Monotonic deadline of an alert's first poll, at a stable phase inside its interval.
+      The phase is a hash of `key` against the wall clock, so alerts sharing an interval
+      spread evenly over it instead of all falling due in the same second, and a restarted
+      process or another shard puts the same key at the same phase.
+      Callers key on the query target, so alerts reading one target stay in step and share
+      one fetch. The phase is one offset modulo the interval, a 5s and a 15s alert on the
+      same target meet every 15s.
+  """
+  if now is None:
+    now = monotonic()
+  if interval <= 0:
+    return now
+  phase = stable_hash(key) % 1000003 / 1000003 * 3600
+  return now + (phase - time()) % interval
+
+
+class Pacer(object):
+  """ Token bucket shared by every poll worker, spaces backend queries toward `qps`.
+      Phase spreading flattens the schedule, this caps what is left, eg. a catch-up after a stall.
+  """
+  def __init__(self, qps, burst=1):
+    self.qps = qps
+    self.burst = burst
+    self.tokens = burst
+    self._last = monotonic()
+    self._lock = Lock()
+
+  def reserve(self, count=1):
+    """ Seconds the caller must sleep before making `count` queries """
+    with self._lock:
+      now = monotonic()
+      self.tokens = min(self.burst, self.tokens + (now - self._last) * self.qps)
+      self._last = now
+      self.tokens -= count
+      # negative tokens are callers queued behind us
+      return 0 if self.tokens >= 0 else -self.tokens / self.qps
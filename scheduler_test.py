@@ -0,0 +1,99 @@
+#!env python3
+
+from collections import Counter
+from scheduler import BURST, COALESCE, Pacer, Scheduler, first_deadline, missed_slots, newly_missed, next_deadline
+from threading import Thread
+from time import monotonic, sleep
+import unittest
+
+
+class Item(object):
+  def __init__(self, name):
+    self.name = name
+
+
+class TestScheduler(unittest.TestCase):
+
+  def test_pop_only_due(self):
+    s = Scheduler()
+    now = monotonic()
+    a, b, c = Item('a'), Item('b'), Item('c')
+    s.put(b, now + 5)
+    s.put(a, now - 1)
+    s.put(c, now + 10)
+    self.assertEqual(s.pop_due(now), [a])
+    self.assertEqual(s.qsize(), 2)
+    self.assertEqual(s.peek(), now + 5)
+    self.assertEqual(s.pop_due(now + 20), [b, c])
+
+  def test_fifo_on_equal_deadline(self):
+    s = Scheduler()
+    items = [Item(i) for i in range(5)]
+    for i in items:
+      s.put(i, 1.0)
+    self.assertEqual(s.pop_due(1.0), items)
+
+  def test_pop_limit(self):
+    s = Scheduler()
+    items = [Item(i) for i in range(5)]
+    for n, i in enumerate(items):
+      s.put(i, float(n))
+    # the rest of a backlog stays on the heap, earliest first
+    self.assertEqual(s.wait_due(limit=2), items[:2])
+    self.assertEqual(s.pop_due(10.0, limit=2), items[2:4])
+    self.assertEqual(s.qsize(), 1)
+
+  def test_wait_due_timeout(self):
+    s = Scheduler()
+    s.put(Item('late'), monotonic() + 60)
+    self.assertEqual(s.wait_due(timeout=0.01), [])
+
+  def test_wait_due_wakes_on_earlier_put(self):
+    s = Scheduler()
+    s.put(Item('late'), monotonic() + 60)
+    early = Item('early')
+    Thread(target=lambda: (sleep(0.05), s.put(early))).start()
+    self.assertEqual(s.wait_due(timeout=5), [early])
+
+  def test_next_deadline(self):
+    # fixed rate from the previous deadline
+    self.assertEqual(next_deadline(100, 15, now=101), 115)
+    # a whole interval behind, skip the missed slot
+    self.assertEqual(next_deadline(100, 15, now=130), 145)
+    # further behind, the next slot ahead on the same grid
+    self.assertEqual(next_deadline(100, 15, now=161), 175)
+    # burst keeps every slot
+    self.assertEqual(next_deadline(100, 15, now=161, policy=BURST), 115)
+    self.assertEqual([missed_slots(lag, 15) for lag in (0, 14.9, 15, 61)], [0, 0, 1, 4])
+
+  def test_newly_missed(self):
+    # a 3 slot stall, burst polls the slots back to back and each poll finds one fewer
+    item = Item('a')
+    item.behind = 0
+    self.assertEqual([newly_missed(item, missed, BURST) for missed in (3, 2, 1, 0)], [3, 0, 0, 0])
+    # slots going by while it catches up are new
+    self.assertEqual([newly_missed(item, missed, BURST) for missed in (3, 4, 3, 2, 1, 0)], [3, 2, 0, 0, 0, 0])
+    # coalesce and skip jump ahead, every late poll is a fresh one
+    self.assertEqual([newly_missed(item, missed, COALESCE) for missed in (3, 2)], [3, 2])
+
+  def test_first_deadline_spreads_phase(self):
+    now = monotonic()
+    deadlines = [first_deadline(f"alert-{i}", 15, now) for i in range(3000)]
+    self.assertTrue(all(now <= d < now + 15 for d in deadlines))
+    # about 200 alerts fall due in each second of the interval, not 3000 in one
+    per_second = Counter(int(d - now) for d in deadlines)
+    self.assertEqual(len(per_second), 15)
+    self.assertLess(max(per_second.values()), 300)
+    # stable, the same name keeps its phase
+    self.assertAlmostEqual(first_deadline('alert-7', 15, now), deadlines[7], delta=0.1)
+
+  def test_pacer(self):
+    pacer = Pacer(100, burst=1)
+    self.assertEqual(pacer.reserve(), 0)
+    waits = [pacer.reserve() for _ in range(5)]
+    # each caller queues 10ms behind the previous one
+    self.assertAlmostEqual(waits[-1] - waits[0], 0.04, delta=0.005)
+
+
+if __name__ == '__main__':
+  unittest.main()
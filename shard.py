@@ -0,0 +1,68 @@
+from bisect import bisect
+import hashlib
+
+
+def stable_hash(key):
+  """ 64 bit hash of a string, the same in every process and on every host (unlike hash()) """
+  return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing(object):
+  """ Consistent hash ring. Each node owns `replicas` points on the ring,
+      a key belongs to the first node point clockwise of its hash.
+      Adding or removing one of n nodes only moves about 1/n of the keys.
+      Every ring puts a key at the same place, so a ring splitting keys another ring already
+      split needs its own `salt`, which moves the keys, or it follows the first ring's cut.
+  """
+  def __init__(self, nodes, replicas=64, salt=''):
+    self.nodes = list(nodes)
+    self.salt = salt
+    points = []
+    for node in self.nodes:
+      for r in range(replicas):
+        points.append((stable_hash(f"{node}#{r}"), node))
+    points.sort()
+    self._hashes = [h for h, _ in points]
+    self._nodes = [n for _, n in points]
+
+  def lookup(self, key):
+    """ Node owning the key """
+    i = bisect(self._hashes, stable_hash(self.salt + key))
+    # wrap around the ring
+    return self._nodes[i % len(self._nodes)]
+
+
+class Partition(object):
+  """ Which keys this process polls. --shard i/n takes node i of a ring of n, and child k of
+      --processes P takes node k of a salted ring of P inside it. The child ring is the same
+      on every host, so hosts running different P still poll each key exactly once.
+  """
+  def __init__(self, shard, child=None):
+    self.index, self.count = shard
+    self.child = child
+    self.shards = HashRing(range(self.count))
+    self.children = HashRing(range(child[1]), salt='process:') if child is not None else None
+
+  def everything(self):
+    """ True if every key is owned """
+    return self.count == 1 and (self.child is None or self.child[1] == 1)
+
+  def owns(self, key):
+    if self.count > 1 and self.shards.lookup(key) != self.index:
+      return False
+    return self.child is None or self.children.lookup(key) == self.child[0]
+
+  def __str__(self):
+    shard = f"{self.index}/{self.count}"
+    return shard if self.child is None else f"{shard} child {self.child[0]}/{self.child[1]}"
+
+
+def parse_shard(value):
+  """ argparse type for --shard i/n, 0 <= i < n """
+  try:
+    index, count = (int(v) for v in value.split('/'))
+  except ValueError:
+    raise ValueError(f"shard must look like i/n, got {value}")
+  if count <= 0 or not 0 <= index < count:
+    raise ValueError(f"shard index must be in 0..{count - 1}, got {value}")
+  return index, count
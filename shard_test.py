@@ -0,0 +1,50 @@
+#!env python3
+
+from shard import HashRing, Partition, parse_shard
+import unittest
+
+
+class TestHashRing(unittest.TestCase):
+
+  names = [f"alert-{i}" for i in range(10000)]
+
+  def test_stable(self):
+    a, b = HashRing(range(4)), HashRing(range(4))
+    self.assertEqual([a.lookup(n) for n in self.names], [b.lookup(n) for n in self.names])
+
+  def test_balance(self):
+    ring = HashRing(range(4))
+    counts = {}
+    for n in self.names:
+      node = ring.lookup(n)
+      counts[node] = counts.get(node, 0) + 1
+    for node in range(4):
+      self.assertGreater(counts[node], 2500 * 0.7)
+      self.assertLess(counts[node], 2500 * 1.3)
+
+  def test_minimal_movement(self):
+    before, after = HashRing(range(4)), HashRing(range(5))
+    moved = sum(1 for n in self.names if before.lookup(n) != after.lookup(n))
+    # ideal is 1/5 of keys, all of them onto the new node
+    self.assertLess(moved, len(self.names) * 0.3)
+    self.assertTrue(all(after.lookup(n) == 4 for n in self.names if before.lookup(n) != after.lookup(n)))
+
+  def test_children_cover_shard_once(self):
+    # host 0 of 2 runs two child processes, host 1 of 2 just one
+    owners = [Partition((0, 2), (0, 2)), Partition((0, 2), (1, 2)), Partition((1, 2), (0, 1))]
+    counts = [sum(p.owns(n) for p in owners) for n in self.names]
+    self.assertEqual(set(counts), {1})
+    # the children split their shard evenly, not along the shard ring's own cut
+    shard = [n for n in self.names if Partition((0, 2)).owns(n)]
+    for child in owners[:2]:
+      self.assertGreater(sum(child.owns(n) for n in shard), len(shard) / 2 * 0.8)
+
+  def test_parse_shard(self):
+    self.assertEqual(parse_shard('1/3'), (1, 3))
+    for bad in ('3/3', '-1/2', '1', 'a/b', '0/0'):
+      with self.assertRaises(ValueError):
+        parse_shard(bad)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,137 @@
+""" Crash-safe lifecycle state. Every state transition appends one JSON line to a journal,
+    a checkpoint rewrites it with only the firing alerts and atomically swaps it in.
+    On boot the journal is replayed so firing alerts do not re-notify and resolves are not lost.
+"""
+
+from alert import INF
+from threading import Lock
+import glob
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def mtime(path):
+  try:
+    return os.path.getmtime(path)
+  except OSError:
+    return 0
+
+
+class Journal(object):
+  """ Append-only log of [name, state, triggered_sec], last line per name wins.
+      Lines are flushed to the OS on every record, so a crashed process loses nothing,
+      checkpoints fsync. A torn last line from a crash mid-write is skipped on load.
+      A child process journal lives at `shard`.k-P next to the journal of its whole `shard`.
+  """
+  def __init__(self, path, shard=None):
+    self.path = path
+    self.shard = shard
+    self.records = 0
+    self._lock = Lock()
+    self._file = None
+
+  def load(self):
+    """ {name: (state, triggered_sec)} of every alert last seen firing """
+    saved = {}
+    for path in self.sources():
+      try:
+        with open(path, encoding='utf-8') as f:
+          for line in f:
+            try:
+              name, state, triggered_sec = json.loads(line)
+            except ValueError:
+              logger.warning("Journal %s skipping torn line %r", path, line[:80])
+              continue
+            if state == 'PASS':
+              saved.pop(name, None)
+            else:
+              saved[name] = (state, triggered_sec)
+      except FileNotFoundError:
+        pass
+    return saved
+
+  def sources(self):
+    """ The files load() replays. A checkpoint drops resolved alerts, so files of different
+        process counts P cannot be merged, the newest generation that covers this child's
+        alerts wins: every child file of one P, or the shard file. A new P's own file counts
+        once written, its siblings still coming up do not hold our alerts. Stale generations
+        are replayed oldest first only when nothing covers, restore keeps the alerts we own.
+    """
+    if self.shard is None:
+      return [self.path]
+    own = self.path.rpartition('-')[2]
+    generations = {None: [self.shard]} if os.path.exists(self.shard) else {}
+    for path in glob.glob(glob.escape(self.shard) + '.*-*'):
+      k, _, n = path[len(self.shard) + 1:].partition('-')
+      if k.isdigit() and n.isdigit():
+        generations.setdefault(n, []).append(path)
+
+    def newest(n):
+      return max(mtime(path) for path in generations[n])
+
+    def covers(n):
+      files = generations[n]
+      return n is None or len(files) == int(n) or (n == own and self.path in files)
+    order = sorted(generations, key=newest, reverse=True)
+    for n in order:
+      if covers(n):
+        return sorted(generations[n])
+    return [path for n in reversed(order) for path in sorted(generations[n])]
+
+  def restore(self, store):
+    """ Warm start, put saved lifecycle state back on the alerts in store. Returns the count """
+    saved = self.load()
+    restored = sum(self.apply(store, item, saved) for item in store)
+    logger.info("Journal %s restored %d firing of %d saved alerts", self.path, restored, len(saved))
+    return restored
+
+  def apply(self, store, item, saved):
+    """ Warm start one alert from a load() result, as it is added. True if it had saved state """
+    if item.name not in saved:
+      return False
+    item.state, item.triggered_sec = saved[item.name]
+    # a firing level counts as over since before the restart, so sustainSecs does not
+    # start over and the deadband holds it, instead of a resolve on the first poll
+    if item.state == item.critical_message:
+      item.warn_since = item.critical_since = -INF
+    elif item.state == item.warn_message:
+      item.warn_since = -INF
+    store.thresholds.sync(item)
+    return True
+
+  def record(self, item):
+    """ Append the alert's current state, called on every transition """
+    line = json.dumps([item.name, item.state, item.triggered_sec]) + '\n'
+    with self._lock:
+      if self._file is None:
+        self._file = open(self.path, 'a', encoding='utf-8')
+      self._file.write(line)
+      self._file.flush()
+      self.records += 1
+
+  def checkpoint(self, store):
+    """ Compact to the firing alerts only: write a temp file, fsync, rename over the journal.
+        Holding the lock keeps records in order, anything after lands in the new file.
+    """
+    tmp = self.path + '.tmp'
+    with self._lock:
+      with open(tmp, 'w', encoding='utf-8') as f:
+        for item in store:
+          if item.state != 'PASS':
+            f.write(json.dumps([item.name, item.state, item.triggered_sec]) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp, self.path)
+      if self._file is not None:
+        self._file.close()
+      self._file = open(self.path, 'a', encoding='utf-8')
+      self.records = 0
+
+  def close(self):
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
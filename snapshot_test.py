@@ -0,0 +1,118 @@
+#!env python3
+
+from snapshot import Journal
+from store import AlertStore
+from thresholds import WARN
+import os
+import tempfile
+import unittest
+
+
+def make(name):
+  return {
+    'name': name,
+    'query': 'q',
+    'intervalSecs': 15,
+    'repeatIntervalSecs': 100,
+    'warn': {'value': 100, 'message': 'warning'},
+    'critical': {'value': 200, 'message': 'critical'},
+  }
+
+
+class TestJournal(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.dir.name, 'state.journal')
+
+  def tearDown(self):
+    self.dir.cleanup()
+
+  def write(self, path, when, *lines):
+    with open(path, 'w') as f:
+      for name, state in lines:
+        f.write(f'["{name}", "{state}", 1000]\n')
+    os.utime(path, (when, when))
+
+  def test_processes_changed(self):
+    # two children wrote their alerts, then the shard restarts with three
+    self.write(self.path + '.0-2', 100, ('a', 'warning'))
+    self.write(self.path + '.1-2', 100, ('b', 'critical'), ('c', 'warning'))
+    child = Journal(self.path + '.2-3', shard=self.path)
+    self.assertEqual(child.load(), {'a': ('warning', 1000), 'b': ('critical', 1000), 'c': ('warning', 1000)})
+    # a sibling already up does not hide the old set, it owns none of our alerts
+    self.write(self.path + '.0-3', 200, ('a', 'warning'))
+    self.assertEqual(len(child.load()), 3)
+    # once all three are written they win, a resolve since drops out of the old set
+    self.write(self.path + '.1-3', 200, ('b', 'critical'))
+    self.write(self.path + '.2-3', 200)
+    self.assertEqual(child.load(), {'a': ('warning', 1000), 'b': ('critical', 1000)})
+    # back to two, the stale own file loses to the newer set of three
+    self.assertEqual(Journal(self.path + '.1-2', shard=self.path).load(), {'a': ('warning', 1000), 'b': ('critical', 1000)})
+
+  def test_shard_file_until_own(self):
+    self.write(self.path, 100, ('a', 'warning'))
+    child = Journal(self.path + '.0-2', shard=self.path)
+    self.assertEqual(child.load(), {'a': ('warning', 1000)})
+    self.write(child.path, 200)
+    self.assertEqual(child.load(), {})
+
+  def test_warm_restart(self):
+    store = AlertStore()
+    a, b = store.add(make('a')), store.add(make('b'))
+    journal = Journal(self.path)
+    a.state, a.triggered_sec = 'warning', 1000
+    journal.record(a)
+    b.state, b.triggered_sec = 'critical', 1001
+    journal.record(b)
+    b.state, b.triggered_sec = 'PASS', 0
+    journal.record(b)
+    journal.close()
+    # a crash mid-write leaves a torn last line
+    with open(self.path, 'a') as f:
+      f.write('["b", "crit')
+
+    fresh = AlertStore()
+    fresh.add(make('a'))
+    fresh.add(make('b'))
+    self.assertEqual(Journal(self.path).restore(fresh), 1)
+    self.assertEqual((fresh.get('a').state, fresh.get('a').triggered_sec), ('warning', 1000))
+    self.assertEqual(fresh.get('b').state, 'PASS')
+    self.assertEqual(fresh.thresholds.state[fresh.get('a').slot], WARN)
+
+  def test_restored_level_stays_over(self):
+    journal = Journal(self.path)
+    store = AlertStore(deadband=10)
+    a = store.add(dict(make('a'), sustainSecs=60))
+    a.state, a.triggered_sec = 'warning', 1000
+    journal.record(a)
+    journal.close()
+
+    fresh = AlertStore(deadband=10)
+    fresh.add(dict(make('a'), sustainSecs=60))
+    Journal(self.path).restore(fresh)
+    a = fresh.get('a')
+    # inside the deadband and well short of sustainSecs, still firing rather than resolved
+    self.assertEqual(fresh.thresholds.states([a], [95], now=5), ['warning'])
+    self.assertEqual(fresh.thresholds.states([a], [50], now=6), ['PASS'])
+
+  def test_checkpoint_keeps_firing_only(self):
+    store = AlertStore()
+    items = [store.add(make(f"a{i}")) for i in range(10)]
+    journal = Journal(self.path)
+    for n, item in enumerate(items):
+      item.state, item.triggered_sec = 'warning', n
+      journal.record(item)
+      if n % 2:
+        item.state, item.triggered_sec = 'PASS', 0
+        journal.record(item)
+    journal.checkpoint(store)
+    journal.record(items[0])
+    journal.close()
+    with open(self.path) as f:
+      self.assertEqual(len(f.readlines()), 6)
+    self.assertEqual(sorted(Journal(self.path).load()), [f"a{i}" for i in range(0, 10, 2)])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,79 @@
+from alert import Alert, digest
+from threading import Lock
+from thresholds import ThresholdTable
+
+
+class AlertStore(object):
+  """ Every alert in the engine, by integer slot.
+      Records are __slots__ Alert objects, numeric set-points and state codes live
+      in the ThresholdTable arrays at the same slot for vectorized evaluation.
+      Removed slots hold None until reused.
+      deadband is the clear percentage of alerts that do not set their own, see alert.clear_value.
+  """
+  def __init__(self, capacity=1024, deadband=0):
+    self.deadband = deadband
+    self.records = []
+    self.index = {}
+    self.thresholds = ThresholdTable(capacity)
+    self._lock = Lock()
+
+  def add(self, data):
+    """ Build an Alert from the server dict and give it a slot """
+    item = Alert(data, self.deadband)
+    with self._lock:
+      slot = self.thresholds.add(item)
+      if slot == len(self.records):
+        self.records.append(item)
+      else:
+        self.records[slot] = item
+      self.index[item.name] = slot
+    return item
+
+  def remove(self, name):
+    """ Drop an alert, returns it with slot -1 so workers holding it let go """
+    with self._lock:
+      slot = self.index.pop(name)
+      item = self.records[slot]
+      self.records[slot] = None
+      self.thresholds.release(item)
+    return item
+
+  def update(self, data):
+    """ Reload an alert's definition in place, keeping its state and triggered_sec """
+    item = self.get(data['name'])
+    item.load(data, self.deadband)
+    self.thresholds.update(item)
+    return item
+
+  def reconcile(self, catalogue):
+    """ Bring the store in line with a fresh /alerts catalogue.
+        Diffs by name plus content hash, unchanged alerts are not touched.
+        Returns the (added, removed, updated) Alert lists for the caller to reschedule.
+    """
+    added, removed, updated = [], [], []
+    seen = set()
+    for data in catalogue:
+      name = data['name']
+      seen.add(name)
+      item = self.get(name)
+      if item is None:
+        added.append(self.add(data))
+      elif item.digest != digest(data):
+        updated.append(self.update(data))
+    for name in [n for n in self.index if n not in seen]:
+      removed.append(self.remove(name))
+    return added, removed, updated
+
+  def get(self, name):
+    """ Alert by name, or None """
+    slot = self.index.get(name)
+    return None if slot is None else self.records[slot]
+
+  def __getitem__(self, slot):
+    return self.records[slot]
+
+  def __len__(self):
+    return len(self.index)
+
+  def __iter__(self):
+    return (item for item in self.records if item is not None)
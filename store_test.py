@@ -0,0 +1,62 @@
+#!env python3
+
+from store import AlertStore
+import unittest
+
+
+def data(name, warn=100, interval=15):
+  return {
+    'name': name,
+    'query': 'test-query-1',
+    'intervalSecs': interval,
+    'repeatIntervalSecs': 100,
+    'sustainSecs': 0,
+    'warn': {'value': warn, 'message': 'warning'},
+    'critical': {'value': 200, 'message': 'critical'},
+  }
+
+
+class TestAlertStore(unittest.TestCase):
+
+  def test_reconcile(self):
+    store = AlertStore()
+    for name in ('a', 'b', 'c'):
+      store.add(data(name))
+    b = store.get('b')
+    b.state, b.triggered_sec = 'warning', 1234
+    c = store.get('c')
+
+    added, removed, updated = store.reconcile([data('a'), data('b', warn=50), data('d')])
+    self.assertEqual([i.name for i in added], ['d'])
+    self.assertEqual(removed, [c])
+    self.assertEqual(updated, [b])
+    # updated in place, lifecycle state kept
+    self.assertIs(store.get('b'), b)
+    self.assertEqual((b.warn_value, b.state, b.triggered_sec), (50, 'warning', 1234))
+    self.assertEqual(store.thresholds.warn[b.slot], 50)
+    # removed alerts let go of their slot, which is reused
+    self.assertEqual(c.slot, -1)
+    self.assertEqual(sorted(i.name for i in store), ['a', 'b', 'd'])
+
+  def test_unchanged_untouched(self):
+    store = AlertStore()
+    store.add(data('a'))
+    self.assertEqual(store.reconcile([data('a')]), ([], [], []))
+
+  def test_removed_while_polling(self):
+    store = AlertStore()
+    a, b = store.add(data('a')), store.add(data('b'))
+    # a poll pass took both, reconcile drops b before the values come back
+    polled = [a, b]
+    store.remove('b')
+    self.assertEqual(store.thresholds.states(polled, [150, 150], now=0), ['warning', None])
+    # the freed slot is untouched, and nothing leaked into the live alert
+    self.assertEqual(store.thresholds.states([a], [0], now=1), ['PASS'])
+    self.assertEqual(store.thresholds.states([b], [150], now=2), [None])
+    c = store.add(data('c'))
+    self.assertEqual(c.slot, 1)
+    self.assertEqual(store.thresholds.states([c], [0], now=3), ['PASS'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,93 @@
+from time import monotonic, sleep
+import logging
+import multiprocessing
+import queue
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor(object):
+  """ Runs `count` child processes of target(index, statsQ, *args), each its own interpreter.
+      Children that die are restarted with exponential backoff.
+      Children put flat dicts of numeric stats on statsQ, the supervisor sums them up.
+  """
+  def __init__(self, count, target, args=(), report=30, max_backoff=60):
+    self.count = count
+    self.target = target
+    self.args = args
+    self.report = report
+    self.max_backoff = max_backoff
+    self.statsQ = multiprocessing.Queue()
+    self.children = {}
+    # latest stats dict per child index
+    self.stats = {}
+    self.restarts = {k: 0 for k in range(count)}
+    self._backoff = {k: 1 for k in range(count)}
+    self._started = {}
+    self._restart_at = {}
+
+  def start_child(self, k):
+    p = multiprocessing.Process(target=self.target, name=f"alert-exec-{k:03}",
+                                args=(k, self.statsQ) + tuple(self.args))
+    p.start()
+    self.children[k] = p
+    self._started[k] = monotonic()
+    logger.info("Supervisor started child %d pid %d", k, p.pid)
+
+  def check(self, now):
+    """ Restart dead children once their backoff has passed """
+    for k, p in self.children.items():
+      if p.is_alive():
+        # a child that stayed up a while earns its backoff back
+        if now - self._started[k] > self.max_backoff:
+          self._backoff[k] = 1
+        continue
+      if k not in self._restart_at:
+        self._restart_at[k] = now + self._backoff[k]
+        logger.error("Supervisor child %d pid %d exited with %s, restarting in %ss", k, p.pid, p.exitcode, self._backoff[k])
+        self._backoff[k] = min(self._backoff[k] * 2, self.max_backoff)
+      elif now >= self._restart_at[k]:
+        del self._restart_at[k]
+        self.restarts[k] += 1
+        self.stats.pop(k, None)
+        self.start_child(k)
+
+  def drain(self):
+    """ Collect whatever stats the children sent """
+    while True:
+      try:
+        k, stats = self.statsQ.get_nowait()
+      except queue.Empty:
+        return
+      self.stats[k] = stats
+
+  def totals(self):
+    """ Sum of the latest stats of every child, plus supervisor counters """
+    totals = {}
+    for stats in self.stats.values():
+      for key, val in stats.items():
+        totals[key] = totals.get(key, 0) + val
+    totals['children_alive'] = sum(1 for p in self.children.values() if p.is_alive())
+    totals['children_restarts'] = sum(self.restarts.values())
+    return totals
+
+  def run(self):
+    """ Start every child and supervise forever """
+    for k in range(self.count):
+      self.start_child(k)
+    next_report = monotonic() + self.report
+    while True:
+      sleep(1)
+      now = monotonic()
+      self.drain()
+      self.check(now)
+      if now >= next_report:
+        next_report = now + self.report
+        logger.info("Supervisor totals %s", self.totals())
+
+  def stop(self):
+    for p in self.children.values():
+      if p.is_alive():
+        p.terminate()
+    for p in self.children.values():
+      p.join(5)
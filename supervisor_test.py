@@ -0,0 +1,43 @@
+#!env python3
+
+from supervisor import Supervisor
+import unittest
+
+
+def report_and_exit(k, statsQ, alerts):
+  statsQ.put((k, {'alerts': alerts + k, 'poll_scheduled': 1}))
+
+
+class TestSupervisor(unittest.TestCase):
+
+  def test_restart_with_backoff(self):
+    supervisor = Supervisor(1, report_and_exit, args=[10], max_backoff=4)
+    supervisor.start_child(0)
+    delays = []
+    now = 100
+    for _ in range(4):
+      supervisor.children[0].join(5)
+      # seen dead, restarted once its backoff has passed
+      supervisor.check(now)
+      delays.append(supervisor._restart_at[0] - now)
+      supervisor.check(now + delays[-1] - 0.5)
+      self.assertEqual(supervisor.restarts[0], len(delays) - 1)
+      now += delays[-1]
+      supervisor.check(now)
+      self.assertEqual(supervisor.restarts[0], len(delays))
+    # doubling, capped at max_backoff
+    self.assertEqual(delays, [1, 2, 4, 4])
+
+  def test_totals(self):
+    supervisor = Supervisor(2, report_and_exit, args=[10])
+    for k in range(2):
+      supervisor.start_child(k)
+      supervisor.children[k].join(5)
+    supervisor.drain()
+    totals = supervisor.totals()
+    self.assertEqual((totals['alerts'], totals['poll_scheduled']), (21, 2))
+    self.assertEqual((totals['children_alive'], totals['children_restarts']), (0, 0))
+
+
+if __name__ == '__main__':
+  unittest.main()
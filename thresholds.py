@@ -0,0 +1,228 @@
+""" Vectorized threshold evaluation. Set-points of every alert live in contiguous arrays
+    indexed by an integer slot, so a whole poll pass is compared in one call instead of
+    one val2state() per alert. NumPy is used when installed, otherwise plain lists.
+    It is imported by the first table, so the CLI starts and prints help without it.
+"""
+
+from alert import HELD_CRITICAL, HELD_WARN, sustained
+from threading import Lock
+from time import monotonic
+import metrics
+
+# numpy once load_numpy() ran and it is installed
+np = None
+_loaded = False
+
+# state codes, index into the per-slot message tuple
+PASS = 0
+WARN = 1
+CRITICAL = 2
+
+INF = float('inf')
+
+# smaller states() batches run alert.sustained per alert, numpy's fixed cost per call outweighs
+# the vector win below about this many alerts, see ./bench.py val2state
+SCALAR_BELOW = 100
+
+
+def load_numpy():
+  """ The numpy module, or None to fall back to lists. Imported once, on first call """
+  global np, _loaded
+  if not _loaded:
+    try:
+      import numpy as np
+    except ImportError:
+      np = None
+    _loaded = True
+  return np
+
+
+class ThresholdTable(object):
+  """ Per alert slot: warn and critical set-points and clear values, sustainSecs, the monotonic
+      time the value went continuously over each set-point (inf when under), the HELD_* bits of
+      levels only the deadband keeps over, and the current state code.
+  """
+  # column name, dtype, fill value of a fresh slot
+  COLUMNS = (
+    ('warn', 'float64', 0),
+    ('critical', 'float64', 0),
+    ('warn_clear', 'float64', 0),
+    ('critical_clear', 'float64', 0),
+    ('sustain', 'float64', 0),
+    ('warn_since', 'float64', INF),
+    ('critical_since', 'float64', INF),
+    ('held', 'int8', 0),
+    ('state', 'int8', PASS),
+  )
+
+  def __init__(self, capacity=1024):
+    self.size = 0
+    self.free = []
+    self._lock = Lock()
+    # (PASS, warn message, critical message) per slot
+    self.messages = []
+    load_numpy()
+    for name, dtype, fill in self.COLUMNS:
+      setattr(self, name, np.full(capacity, fill, dtype=dtype) if np is not None else [])
+
+  def add(self, item):
+    """ Give the alert a slot, stored on item.slot. Released slots are reused first """
+    with self._lock:
+      if self.free:
+        slot = self.free.pop()
+      else:
+        slot = self.size
+        self.size += 1
+        self.messages.append(None)
+        for name, dtype, fill in self.COLUMNS:
+          column = getattr(self, name)
+          if np is None:
+            column.append(fill)
+          elif slot == len(column):
+            # double the arrays, amortised O(1) append
+            grown = np.full(slot * 2 or 1, fill, dtype=dtype)
+            grown[:slot] = column
+            setattr(self, name, grown)
+      self._write(slot, item)
+      self._sync(slot, item)
+    item.slot = slot
+    return slot
+
+  def sync(self, item):
+    """ Reload the state code from item.state, after it was set outside evaluate() """
+    with self._lock:
+      self._sync(item.slot, item)
+
+  def update(self, item):
+    """ New set-points for an alert already holding a slot, its state code is kept """
+    with self._lock:
+      self._write(item.slot, item)
+
+  def release(self, item):
+    """ Slot free for the next add(), item.slot becomes -1 under the lock states() reads it with """
+    with self._lock:
+      self.messages[item.slot] = None
+      self.free.append(item.slot)
+      item.slot = -1
+
+  def _sync(self, slot, item, state=None):
+    messages = self.messages[slot]
+    state = item.state if state is None else state
+    self.state[slot] = messages.index(state) if state in messages else PASS
+    self.warn_since[slot] = item.warn_since
+    self.critical_since[slot] = item.critical_since
+    self.held[slot] = item.held
+
+  def _write(self, slot, item):
+    self.warn[slot] = item.warn_value
+    self.critical[slot] = item.critical_value
+    self.warn_clear[slot] = item.warn_clear
+    self.critical_clear[slot] = item.critical_clear
+    self.sustain[slot] = item.sustainSecs
+    self.messages[slot] = ('PASS', item.warn_message, item.critical_message)
+
+  def evaluate(self, slots, values, now=None):
+    """ New state codes for the slots, and a mask of which ones changed state.
+        Same comparisons as alert.val2state, but a firing level only counts once the
+        value has stayed over it for sustainSecs, see alert.sustained.
+        Stores the new codes and over-threshold times. Holds the lock, so a concurrent
+        add() growing the arrays cannot lose the writes.
+    """
+    if now is None:
+      now = monotonic()
+    with self._lock:
+      return self._evaluate(slots, values, now)
+
+  def _evaluate(self, slots, values, now):
+    if np is not None:
+      slots = np.asarray(slots, dtype=np.intp)
+      values = np.asarray(values, dtype=np.float64)
+      sustain = self.sustain[slots]
+      over_warn = values > self.warn[slots]
+      over_critical = values > self.critical[slots]
+      # a level that fired stays over until the value drops to its clear value,
+      # a run still inside sustainSecs never fired and is not held
+      state = self.state[slots]
+      held_warn = ~over_warn & (state >= WARN) & (self.warn_since[slots] < INF) & (values > self.warn_clear[slots])
+      held_critical = (~over_critical & (state >= CRITICAL) & (self.critical_since[slots] < INF)
+                       & (values > self.critical_clear[slots]))
+      # a held level going back over is a resolve and a re-notify that never happened
+      held = self.held[slots]
+      self._suppressed(np.count_nonzero(over_warn & (held & HELD_WARN != 0)),
+                       np.count_nonzero(over_critical & (held & HELD_CRITICAL != 0)))
+      self.held[slots] = held_warn * HELD_WARN | held_critical * HELD_CRITICAL
+      # keep the earliest time of an unbroken run over each set-point, inf once it drops under
+      warn_since = np.where(over_warn | held_warn, np.minimum(self.warn_since[slots], now), INF)
+      critical_since = np.where(over_critical | held_critical, np.minimum(self.critical_since[slots], now), INF)
+      codes = np.where(now - critical_since >= sustain, CRITICAL,
+                       np.where(now - warn_since >= sustain, WARN, PASS)).astype(np.int8)
+      changed = codes != self.state[slots]
+      self.warn_since[slots] = warn_since
+      self.critical_since[slots] = critical_since
+      self.state[slots] = codes
+      return codes, changed
+
+    codes, changed = [], []
+    suppressed_warn = suppressed_critical = 0
+    for slot, value in zip(slots, values):
+      sustain = self.sustain[slot]
+      over_warn = value > self.warn[slot]
+      over_critical = value > self.critical[slot]
+      state = self.state[slot]
+      held_warn = not over_warn and state >= WARN and self.warn_since[slot] < INF and value > self.warn_clear[slot]
+      held_critical = (not over_critical and state >= CRITICAL and self.critical_since[slot] < INF
+                       and value > self.critical_clear[slot])
+      suppressed_warn += over_warn and self.held[slot] & HELD_WARN != 0
+      suppressed_critical += over_critical and self.held[slot] & HELD_CRITICAL != 0
+      self.held[slot] = HELD_WARN * held_warn | HELD_CRITICAL * held_critical
+      warn_since = min(self.warn_since[slot], now) if over_warn or held_warn else INF
+      critical_since = min(self.critical_since[slot], now) if over_critical or held_critical else INF
+      code = CRITICAL if now - critical_since >= sustain else WARN if now - warn_since >= sustain else PASS
+      codes.append(code)
+      changed.append(code != self.state[slot])
+      self.warn_since[slot] = warn_since
+      self.critical_since[slot] = critical_since
+      self.state[slot] = code
+    self._suppressed(suppressed_warn, suppressed_critical)
+    return codes, changed
+
+  def _suppressed(self, warn, critical):
+    if warn:
+      metrics.deadband_suppressed.inc('warning', value=int(warn))
+    if critical:
+      metrics.deadband_suppressed.inc('critical', value=int(critical))
+
+  def states(self, items, values, now=None):
+    """ State strings for a batch of alerts, like calling alert.sustained on each.
+        None for an alert removed since the caller took it, eg. while its query was in flight,
+        its slot may already belong to another alert.
+        A batch under SCALAR_BELOW alerts does call alert.sustained, so the over-threshold
+        times and held bits are kept on the alerts as well as in the columns.
+    """
+    if now is None:
+      now = monotonic()
+    states = [None] * len(items)
+    with self._lock:
+      live = [i for i, item in enumerate(items) if item.slot >= 0]
+      if len(live) < SCALAR_BELOW:
+        for i in live:
+          item = items[i]
+          states[i] = sustained(item, values[i], now)
+          self._sync(item.slot, item, states[i])
+        return states
+      slots = [items[i].slot for i in live]
+      codes, _ = self._evaluate(slots, [values[i] for i in live], now)
+      if np is not None:
+        codes = codes.tolist()
+        warn_since = self.warn_since[slots].tolist()
+        critical_since = self.critical_since[slots].tolist()
+        held = self.held[slots].tolist()
+      else:
+        warn_since = [self.warn_since[slot] for slot in slots]
+        critical_since = [self.critical_since[slot] for slot in slots]
+        held = [self.held[slot] for slot in slots]
+      for i, slot, code, ws, cs, h in zip(live, slots, codes, warn_since, critical_since, held):
+        item = items[i]
+        item.warn_since, item.critical_since, item.held = ws, cs, h
+        states[i] = self.messages[slot][code]
+    return states
@@ -0,0 +1,124 @@
+#!env python3
+
+from alert import Alert, sustained, val2state
+from thresholds import ThresholdTable, PASS, WARN, CRITICAL
+from contextlib import nullcontext
+from unittest import mock
+import metrics
+import unittest
+
+
+def make(name, warn, critical, sustain=0, deadband=0, **extra):
+  return Alert(dict({
+    'name': name,
+    'query': 'q',
+    'intervalSecs': 15,
+    'repeatIntervalSecs': 100,
+    'sustainSecs': sustain,
+    'warn': {'value': warn, 'message': 'warning'},
+    'critical': {'value': critical, 'message': 'critical'},
+  }, **extra), deadband)
+
+
+class TestThresholdTable(unittest.TestCase):
+
+  def setUp(self):
+    # every batch on the vector path, however small, the scalar one is alert.sustained
+    patcher = mock.patch('thresholds.SCALAR_BELOW', 0)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_matches_val2state(self):
+    table = ThresholdTable(capacity=1)
+    items = [make(f"a{i}", 100, 200) for i in range(7)]
+    for item in items:
+      table.add(item)
+    values = [0, 100, 100.5, 200, 201, 150, 1e9]
+    self.assertEqual(table.states(items, values), [val2state(i, v) for i, v in zip(items, values)])
+
+  def test_transition_mask(self):
+    table = ThresholdTable()
+    a, b = make('a', 10, 20), make('b', 10, 20)
+    table.add(a)
+    table.add(b)
+    codes, changed = table.evaluate([a.slot, b.slot], [5, 15])
+    self.assertEqual(list(codes), [PASS, WARN])
+    self.assertEqual(list(changed), [False, True])
+    codes, changed = table.evaluate([a.slot, b.slot], [5, 25])
+    self.assertEqual(list(codes), [PASS, CRITICAL])
+    self.assertEqual(list(changed), [False, True])
+
+  def test_sustain(self):
+    table = ThresholdTable()
+    a, b = make('a', 10, 20, sustain=30), make('b', 10, 20, sustain=30)
+    table.add(a)
+    # a follows the table, b the scalar path, they must agree
+    samples = [(0, 25), (15, 25), (30, 25), (45, 15), (60, 5), (75, 15), (90, 12), (105, 11)]
+    expected = ['PASS', 'PASS', 'critical', 'warning', 'PASS', 'PASS', 'PASS', 'warning']
+    for (now, value), state in zip(samples, expected):
+      self.assertEqual(table.states([a], [value], now), [state])
+      self.assertEqual(sustained(b, value, now), state)
+
+  def test_deadband(self):
+    table = ThresholdTable()
+    # 10% deadband: warn clears at 90, critical at 180
+    a, b = make('a', 100, 200, deadband=10), make('b', 100, 200, deadband=10)
+    table.add(a)
+    suppressed = dict(metrics.deadband_suppressed.values)
+    samples = [101, 99, 101, 95, 205, 190, 185, 205, 179, 91, 90, 95, 101]
+    expected = ['warning', 'warning', 'warning', 'warning', 'critical', 'critical', 'critical', 'critical',
+                'warning', 'warning', 'PASS', 'PASS', 'warning']
+    for now, (value, state) in enumerate(zip(samples, expected)):
+      self.assertEqual(table.states([a], [value], now), [state])
+      self.assertEqual(sustained(b, value, now), state)
+      # what transition() does with it in the engine
+      b.state = state
+    # warn held at 99 and at 95, critical at 190 and 185, each run going back over counts once, on both paths
+    self.assertEqual(metrics.deadband_suppressed.values.get(('warning',), 0) - suppressed.get(('warning',), 0), 4)
+    self.assertEqual(metrics.deadband_suppressed.values.get(('critical',), 0) - suppressed.get(('critical',), 0), 2)
+
+  def test_sustain_with_deadband(self):
+    # one sample over, then under the set-point but over the clear value, is not a level that fired
+    samples = [(0, 101), (10, 95), (20, 95), (30, 95), (40, 95), (50, 101), (60, 101), (80, 101), (90, 95), (100, 89)]
+    expected = ['PASS'] * 7 + ['warning', 'warning', 'PASS']
+    for numpy in (True, False):
+      # the list path too, as without numpy installed
+      with nullcontext() if numpy else mock.patch('thresholds.np', None):
+        table = ThresholdTable()
+        a, b = make('a', 100, 200, sustain=30, deadband=10), make('b', 100, 200, sustain=30, deadband=10)
+        table.add(a)
+        for (now, value), state in zip(samples, expected):
+          self.assertEqual(table.states([a], [value], now), [state])
+          self.assertEqual(sustained(b, value, now), state)
+          b.state = state
+
+  def test_paths_agree(self):
+    # an alert polled alone takes the scalar path, in a big pass the vector one, its timers carry over
+    samples = [(0, 101), (10, 101), (20, 101), (30, 95), (40, 205), (50, 205), (60, 205), (70, 185), (80, 150), (90, 95), (100, 89)]
+    expected = ['PASS', 'PASS', 'warning', 'warning', 'warning', 'warning', 'critical', 'critical', 'warning', 'warning', 'PASS']
+    for numpy in (True, False):
+      with nullcontext() if numpy else mock.patch('thresholds.np', None):
+        table = ThresholdTable()
+        a, b = make('a', 100, 200, sustain=20, deadband=10), make('b', 100, 200, sustain=20, deadband=10)
+        table.add(a)
+        for i, ((now, value), state) in enumerate(zip(samples, expected)):
+          with mock.patch('thresholds.SCALAR_BELOW', i % 2 * 100):
+            self.assertEqual(table.states([a], [value], now), [state])
+          self.assertEqual(sustained(b, value, now), state)
+          # what transition() does with it in the engine
+          a.state = b.state = state
+
+  def test_clear_values(self):
+    a = make('a', 100, 200, deadband=10, deadbandPct=20)
+    self.assertEqual((a.warn_clear, a.critical_clear), (80, 160))
+    b = make('b', 100, 200)
+    b.load({'name': 'b', 'query': 'q', 'intervalSecs': 15, 'repeatIntervalSecs': 100,
+            'warn': {'value': 100, 'message': 'warning', 'clear': 50},
+            'critical': {'value': 200, 'message': 'critical', 'clear': 250}}, deadband=10)
+    # a clear above the set-point is no deadband
+    self.assertEqual((b.warn_clear, b.critical_clear), (50, 200))
+    self.assertEqual((make('c', -100, 0, deadband=10).warn_clear), -110)
+
+
+if __name__ == '__main__':
+  unittest.main()